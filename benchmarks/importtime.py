@@ -0,0 +1,83 @@
+"""Startup time benchmark for zotify.
+
+Runs the commands that should start without the downloader's dependencies
+under python -X importtime, and fails when one of them is slower than the
+budget or imports a module that is meant to be loaded on first use:
+
+python -m benchmarks.importtime
+python -m benchmarks.importtime --budget-ms 100 --top 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+COMMANDS = {
+    'help': ['-m', 'zotify', '--help'],
+    'import': ['-c', 'import zotify.app'],
+}
+# only imported once a session, request, stream, tag or conversion needs them
+DEFERRED = ('librespot', 'music_tag', 'ffmpy', 'tabulate', 'tqdm', 'requests', 'PIL', 'pwinput', 'httpx', 'asyncio',
+            'sqlite3', 'http.server', 'concurrent', 'logging', 'hashlib')
+
+
+def parse_importtime(stderr: str) -> list:
+    """ Returns (cumulative_us, self_us, module) for every import -X importtime reported """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        # one space before top level imports, two more for each level of nesting
+        imports.append((int(cumulative), int(own), name[1:].rstrip()))
+    return imports
+
+
+def measure(name: str, repeat: int) -> dict:
+    args = COMMANDS[name]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT), os.environ.get('PYTHONPATH')])))
+    walls = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], env=env, cwd=ROOT, capture_output=True)
+        walls.append(time.perf_counter() - start)
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args], env=env, cwd=ROOT, capture_output=True, text=True)
+    imports = parse_importtime(result.stderr)
+    modules = {module.strip() for _, _, module in imports}
+    return {
+        'command': name,
+        'wall_ms': min(walls) * 1000,
+        'import_ms': sum(cumulative for cumulative, _, module in imports if not module.startswith(' ')) / 1000,
+        'imports': imports,
+        'deferred': sorted(m for m in modules if m.split('.')[0] in DEFERRED or m in DEFERRED),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks.importtime', description='zotify startup time benchmark.')
+    parser.add_argument('--budget-ms', type=float, default=100, help='Slowest acceptable wall time of each command.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each command, the fastest one is reported.')
+    parser.add_argument('--top', type=int, default=15, help='Slowest imports listed for each command.')
+    options = parser.parse_args()
+
+    failed = False
+    for name in COMMANDS:
+        result = measure(name, options.repeat)
+        print(f"{name:<8} {result['wall_ms']:7.1f} ms wall  {result['import_ms']:7.1f} ms importing")
+        for cumulative, own, module in sorted(result['imports'], reverse=True)[:options.top]:
+            print(f'  {cumulative / 1000:8.1f} ms  {own / 1000:8.1f} ms self  {module.strip()}')
+        if result['wall_ms'] > options.budget_ms:
+            print(f"  over the {options.budget_ms:g} ms budget")
+            failed = True
+        if result['deferred']:
+            print(f"  imports modules that should load on first use: {', '.join(result['deferred'])}")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+"""Local stand-in for the Spotify endpoints zotify talks to.
+
+Requests reach it through RedirectAdapter (RedirectTransport for the asyncio
+client), which keeps the original host as the first path segment: https://api.spotify.com/v1/tracks?ids=... arrives as
+/api.spotify.com/v1/tracks?ids=... The catalog is generated from the ids
+themselves, so every run of a scenario sees the same data.
+"""
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+import httpx
+from requests.adapters import HTTPAdapter
+
+BASE62 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+GENRES = ['ambient', 'bossa nova', 'drum and bass', 'folk', 'jazz', 'krautrock', 'shoegaze', 'synthwave']
+
+
+def spotify_id(*parts) -> str:
+    """ Returns a stable 22 character base62 id for parts """
+    number = int.from_bytes(hashlib.sha256('/'.join(map(str, parts)).encode()).digest(), 'big')
+    chars = []
+    for _ in range(22):
+        number, rest = divmod(number, 62)
+        chars.append(BASE62[rest])
+    return ''.join(chars)
+
+
+def cover_art() -> bytes:
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new('RGB', (640, 640), (30, 144, 255)).save(out, format='JPEG', quality=85)
+    return out.getvalue()
+
+
+class Catalog:
+    """Synthetic library: artists with albums, albums with tracks, playlists, liked songs and shows."""
+    def __init__(self, albums_per_artist=10, tracks_per_album=12, artists_per_track=2):
+        self.albums_per_artist = albums_per_artist
+        self.tracks_per_album = tracks_per_album
+        self.artists_per_track = artists_per_track
+        # every generated id maps back to what it was generated from
+        self.albums = {}
+        self.tracks = {}
+        self.playlists = {}
+        self.shows = {}
+        self.episodes = {}
+        self.artists = {}
+        self.liked = []
+        self._lock = threading.Lock()
+
+    def artist(self, n: int) -> str:
+        artist_id = spotify_id('artist', n)
+        with self._lock:
+            self.artists[artist_id] = n
+            for a in range(self.albums_per_artist):
+                album_id = spotify_id('album', n, a)
+                self.albums[album_id] = (n, a)
+                for t in range(self.tracks_per_album):
+                    self.tracks[spotify_id('track', n, a, t)] = (n, a, t)
+        return artist_id
+
+    def playlist(self, name: str, size: int) -> str:
+        playlist_id = spotify_id('playlist', name)
+        artists = max(1, size // (self.albums_per_artist * self.tracks_per_album) + 1)
+        for n in range(artists):
+            self.artist(1000 + n)
+        track_ids = [spotify_id('track', 1000 + i % artists, (i // artists) % self.albums_per_artist,
+                                (i // (artists * self.albums_per_artist)) % self.tracks_per_album) for i in range(size)]
+        self.playlists[playlist_id] = (name, track_ids)
+        return playlist_id
+
+    def like(self, size: int) -> list:
+        self.liked = self.playlists[self.playlist('liked', size)][1]
+        return self.liked
+
+    def show(self, name: str, episodes: int, episode_size: int) -> str:
+        show_id = spotify_id('show', name)
+        episode_ids = [spotify_id('episode', name, e) for e in range(episodes)]
+        self.shows[show_id] = (name, episode_ids)
+        for e, episode_id in enumerate(episode_ids):
+            self.episodes[episode_id] = (show_id, e, episode_size)
+        return show_id
+
+    def artist_object(self, artist_id: str, full=False) -> dict:
+        n = self.artists.get(artist_id, 0)
+        artist = {'id': artist_id, 'name': f'Artist {n}', 'type': 'artist',
+                  'href': f'https://api.spotify.com/v1/artists/{artist_id}'}
+        if full:
+            artist['genres'] = [GENRES[n % len(GENRES)], GENRES[(n * 3 + 1) % len(GENRES)]]
+        return artist
+
+    def album_object(self, album_id: str) -> dict:
+        n, a = self.albums[album_id]
+        return {
+            'id': album_id, 'name': f'Album {n}.{a}', 'release_date': f'{1990 + a}-01-01', 'type': 'album',
+            'artists': [self.artist_object(spotify_id('artist', n))],
+            'images': [{'url': f'https://i.scdn.co/image/{album_id}', 'width': 640, 'height': 640}],
+        }
+
+    def track_object(self, track_id: str) -> dict:
+        n, a, t = self.tracks[track_id]
+        artists = []
+        for k in range(self.artists_per_track):
+            # featured artists are drawn from a small pool so they recur across tracks
+            artist_n = n if k == 0 else (n + k) % 50
+            artist_id = spotify_id('artist', artist_n)
+            self.artists.setdefault(artist_id, artist_n)
+            artists.append(artist_id)
+        return {
+            'id': track_id, 'name': f'Track {n}.{a}.{t}', 'type': 'track', 'is_playable': True,
+            'duration_ms': 180000, 'disc_number': 1, 'track_number': t + 1, 'explicit': False,
+            'artists': [self.artist_object(artist_id) for artist_id in artists],
+            'album': self.album_object(spotify_id('album', n, a)),
+        }
+
+    def episode_object(self, episode_id: str) -> dict:
+        show_id, e, _ = self.episodes[episode_id]
+        return {'id': episode_id, 'name': f'Episode {e}', 'type': 'episode', 'duration_ms': 3600000,
+                'show': {'id': show_id, 'name': self.shows[show_id][0]}}
+
+
+def page(items: list, query: dict, url: str) -> dict:
+    limit = int(query.get('limit', ['20'])[0])
+    offset = int(query.get('offset', ['0'])[0])
+    following = offset + limit
+    return {'items': items[offset:following], 'total': len(items), 'limit': limit, 'offset': offset,
+            'next': f'{url}?offset={following}&limit={limit}' if following < len(items) else None}
+
+
+class MockSpotify:
+    """HTTP server answering like the Web API, spclient, pathfinder, the image CDN and a podcast host.
+
+    latency is added to every API response, throttle_rate is the share of
+    API requests answered with 429 and podcast_bandwidth caps direct episode
+    downloads in bytes per second per connection.
+    """
+    def __init__(self, catalog: Catalog, latency=0.0, throttle_rate=0.0, retry_after=0, podcast_bandwidth=0, seed=0):
+        self.catalog = catalog
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.podcast_bandwidth = podcast_bandwidth
+        self.requests = Counter()
+        self.cover = cover_art()
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self) -> 'MockSpotify':
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='mock-spotify', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+
+    @property
+    def address(self) -> str:
+        return f'127.0.0.1:{self._server.server_address[1]}'
+
+    @property
+    def api_calls(self) -> int:
+        return sum(count for kind, count in self.requests.items() if kind not in ('image', 'podcast'))
+
+    def count(self, kind: str) -> bool:
+        """ Counts a request, returns True if it should be throttled """
+        with self._lock:
+            self.requests[kind] += 1
+            return kind not in ('image', 'podcast') and self._random.random() < self.throttle_rate
+
+    def route(self, host: str, path: str, query: dict):
+        """ Returns the request kind and the JSON answer, None for unknown paths """
+        c = self.catalog
+        url = f'https://{host}{path}'
+        if host == 'spclient.wg.spotify.com' and path.startswith('/color-lyrics/'):
+            lines = [{'startTimeMs': str(i * 4000), 'words': f'line {i}'} for i in range(40)]
+            return 'lyrics', {'lyrics': {'syncType': 'LINE_SYNCED', 'lines': lines}}
+        if host == 'api-partner.spotify.com':
+            episode_id = json.loads(query['variables'][0])['uri'].rsplit(':', 1)[-1]
+            return 'pathfinder', {'data': {'episode': {
+                'audio': {'items': [{'url': f'https://podcasts.example.com/{episode_id}.mp3'}]},
+                'audio_preview_url': None}}}
+        if host != 'api.spotify.com':
+            return None, None
+
+        ids = query.get('ids', [''])[0].split(',')
+        match = re.fullmatch(r'/v1/(\w+)(?:/(\w+))?(?:/(\w+))?', path)
+        if not match:
+            return None, None
+        collection, item_id, sub = match.groups()
+        if collection == 'tracks' and not item_id:
+            return 'tracks', {'tracks': [c.track_object(i) if i in c.tracks else None for i in ids]}
+        if collection == 'artists' and not item_id:
+            return 'artists', {'artists': [c.artist_object(i, full=True) for i in ids]}
+        if collection == 'artists' and sub == 'albums':
+            n = c.artists.get(item_id, 0)
+            albums = [c.album_object(spotify_id('album', n, a)) for a in range(c.albums_per_artist)]
+            return 'artist_albums', page(albums, query, url)
+        if collection == 'artists':
+            return 'artist', c.artist_object(item_id, full=True)
+        if collection == 'albums' and sub == 'tracks':
+            n, a = c.albums[item_id]
+            tracks = [{'id': spotify_id('track', n, a, t), 'name': f'Track {n}.{a}.{t}'} for t in range(c.tracks_per_album)]
+            return 'album_tracks', page(tracks, query, url)
+        if collection == 'albums':
+            return 'album', c.album_object(item_id)
+        if collection == 'playlists' and sub == 'tracks':
+            tracks = [{'track': {'id': i, 'name': c.track_object(i)['name'], 'type': 'track'}} for i in c.playlists[item_id][1]]
+            return 'playlist_tracks', page(tracks, query, url)
+        if collection == 'playlists':
+            return 'playlist', {'name': c.playlists[item_id][0], 'owner': {'display_name': 'benchmark'}}
+        if collection == 'me' and item_id == 'tracks':
+            return 'saved_tracks', page([{'track': c.track_object(i)} for i in c.liked], query, url)
+        if collection == 'shows' and sub == 'episodes':
+            return 'show_episodes', page([{'id': i} for i in c.shows[item_id][1]], query, url)
+        if collection == 'episodes' and not item_id:
+            return 'episodes', {'episodes': [c.episode_object(i) if i in c.episodes else None for i in ids]}
+        if collection == 'episodes':
+            return 'episode', c.episode_object(item_id)
+        if collection == 'search':
+            tracks = [c.track_object(i) for i in list(c.tracks)[:int(query.get('limit', ['10'])[0])]]
+            return 'search', {'tracks': {'items': tracks}, 'albums': {'items': []}, 'artists': {'items': []},
+                              'playlists': {'items': []}}
+        return None, None
+
+
+def make_handler(mock: MockSpotify):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            host, _, path = parts.path.lstrip('/').partition('/')
+            path = '/' + path
+            query = parse_qs(parts.query)
+
+            if host == 'i.scdn.co':
+                mock.count('image')
+                self.send_body(200, mock.cover, 'image/jpeg')
+                return
+            if host == 'podcasts.example.com':
+                mock.count('podcast')
+                self.send_episode(path.strip('/').split('.')[0])
+                return
+
+            kind, body = mock.route(host, path, query)
+            if kind is None:
+                mock.count('unknown')
+                self.send_body(404, b'{"error": {"status": 404, "message": "not mocked"}}')
+                return
+            if mock.latency:
+                time.sleep(mock.latency)
+            if mock.count(kind):
+                self.send_body(429, b'{"error": {"status": 429, "message": "API rate limit exceeded"}}',
+                               headers={'Retry-After': str(mock.retry_after)})
+                return
+            self.send_body(200, json.dumps(body).encode())
+
+        def send_episode(self, episode_id):
+            size = mock.catalog.episodes[episode_id][2]
+            start, end = 0, size - 1
+            status = 200
+            requested = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if requested:
+                start = int(requested.group(1))
+                end = min(size - 1, int(requested.group(2))) if requested.group(2) else size - 1
+                status = 206
+            self.send_response(status)
+            self.send_header('Content-Type', 'audio/mpeg')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', f'"{episode_id}"')
+            if status == 206:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.end_headers()
+
+            chunk = bytes(64 * 1024)
+            position = start
+            started = time.perf_counter()
+            while position <= end:
+                n = min(len(chunk), end - position + 1)
+                self.wfile.write(chunk[:n])
+                position += n
+                if mock.podcast_bandwidth:
+                    ahead = (position - start) / mock.podcast_bandwidth - (time.perf_counter() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+        def send_body(self, status, body, content_type='application/json', headers=None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class RedirectAdapter(HTTPAdapter):
+    """Sends every request to the mock server, keeping the original host as the first path segment."""
+    def __init__(self, address: str, **kwargs):
+        self.address = address
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = urlunsplit(('http', self.address, f'/{parts.netloc}{parts.path}', parts.query, ''))
+        return super().send(request, **kwargs)
+
+
+class RedirectTransport(httpx.AsyncHTTPTransport):
+    """RedirectAdapter for the httpx client of zotify.asyncapi."""
+    def __init__(self, address: str, **kwargs):
+        self.address = address
+        super().__init__(**kwargs)
+
+    async def handle_async_request(self, request):
+        request.url = request.url.copy_with(scheme='http', netloc=self.address.encode(),
+                                            path=f'/{request.url.host}{request.url.path}')
+        return await super().handle_async_request(request)
@@ -0,0 +1,229 @@
+"""Offline throughput benchmarks for zotify.
+
+Runs real zotify code against the local MockSpotify server and a fake
+content feeder, so no account or network is needed. zotify's own
+dependencies (and ffmpeg, for conversion and tagging) must be installed:
+
+python -m benchmarks.run                                   # every scenario
+python -m benchmarks.run playlist --tracks 200 --workers 4 --latency 0.05
+python -m benchmarks.run liked --throttle-rate 0.02 --json results.json
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.fake_stream import FakeContentStream, synthetic_ogg
+from benchmarks.mock_api import Catalog, MockSpotify, RedirectAdapter, RedirectTransport
+
+SCENARIOS = {}
+
+
+def scenario(fn):
+    SCENARIOS[fn.__name__] = fn
+    return fn
+
+
+@scenario
+def playlist(catalog: Catalog, options, workdir: Path):
+    """ A playlist of --tracks tracks, nothing downloaded before """
+    from zotify.app import download_from_urls
+
+    playlist_id = catalog.playlist('benchmark', options.tracks)
+    return options.tracks, lambda: download_from_urls([f'https://open.spotify.com/playlist/{playlist_id}'])
+
+
+@scenario
+def discography(catalog: Catalog, options, workdir: Path):
+    """ Every album of one artist, --albums albums of 12 tracks """
+    from zotify.album import download_artist_albums
+
+    artist_id = catalog.artist(1)
+    return options.albums * catalog.tracks_per_album, lambda: download_artist_albums(artist_id)
+
+
+@scenario
+def liked(catalog: Catalog, options, workdir: Path):
+    """ Liked songs sync of --tracks tracks with --archived of them downloaded before """
+    from zotify.app import download_liked_songs
+    from zotify.zotify import Zotify
+
+    track_ids = catalog.like(options.tracks)
+    archived = track_ids[:int(len(track_ids) * options.archived)]
+    with open(Zotify.CONFIG.get_song_archive(), 'w', encoding='utf-8') as file:
+        file.writelines(f'{track_id}\t2024-01-01 00:00:00\tArtist\tTrack\tTrack.ogg\n' for track_id in archived)
+    return options.tracks, download_liked_songs
+
+
+@scenario
+def podcast(catalog: Catalog, options, workdir: Path):
+    """ Backfill of a show with --episodes episodes hosted outside Spotify """
+    from zotify.app import download_from_urls
+
+    show_id = catalog.show('benchmark', options.episodes, options.episode_size * 1024 * 1024)
+    return options.episodes, lambda: download_from_urls([f'https://open.spotify.com/show/{show_id}'])
+
+
+class FakeSession:
+    def get_user_attribute(self, key):
+        return 'premium'
+
+
+class FakeSessions:
+    """Replaces SessionManager: a premium account and a constant token, nothing to log in."""
+    session = FakeSession()
+
+    def token(self) -> str:
+        return 'benchmark'
+
+
+def configure(workdir: Path, options) -> None:
+    """ Loads a throwaway config whose paths all live in workdir """
+    from librespot.audio.decoders import AudioQuality
+
+    from zotify.zotify import Zotify
+
+    args = argparse.Namespace(
+        config_location=str(workdir / 'config.json'),
+        no_splash=True,
+        root_path=str(workdir / 'music'),
+        root_podcast_path=str(workdir / 'podcasts'),
+        song_archive=str(workdir / '.song_archive'),
+        credentials_location=str(workdir / 'credentials.json'),
+        metadata_cache_location=str(workdir / 'metadata_cache.sqlite'),
+        job_journal_location=str(workdir / 'jobs.sqlite'),
+        metadata_cache='False',
+        workers=str(options.workers),
+        download_format=options.format,
+        md_save_genres=str(options.genres),
+        download_lyrics=str(options.lyrics),
+        ffmpeg_pipe=str(options.pipe),
+        skip_previously_downloaded='True',
+        bulk_wait_time='0',
+        print_splash='False',
+        print_skips='False',
+        print_downloads='False',
+        print_download_progress='False',
+        print_progress_info='False',
+        print_warnings='False',
+    )
+    Zotify.CONFIG.load(args)
+    Zotify.DOWNLOAD_QUALITY = AudioQuality.HIGH
+
+    audio = synthetic_ogg(options.track_seconds)
+    Zotify.SESSIONS = FakeSessions()
+    Zotify.get_content_stream = classmethod(
+        lambda cls, content_id, quality: FakeContentStream(audio, options.bandwidth * 1024, options.stream_latency))
+
+
+def connect(mock: MockSpotify) -> None:
+    import requests
+
+    from zotify import asyncapi
+    from zotify.zotify import Zotify
+
+    session = requests.Session()
+    adapter = RedirectAdapter(mock.address, pool_connections=8, pool_maxsize=Zotify.CONFIG.get_http_pool_size())
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    Zotify.HTTP = session
+    asyncapi.API = asyncapi.AsyncApi(transport=RedirectTransport(mock.address))
+
+
+def peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run(name: str, options) -> dict:
+    from zotify.metrics import METRICS
+
+    with tempfile.TemporaryDirectory(prefix=f'zotify-bench-{name}-') as tmp:
+        workdir = Path(tmp)
+        configure(workdir, options)
+        catalog = Catalog(albums_per_artist=options.albums)
+        mock = MockSpotify(catalog, latency=options.latency, throttle_rate=options.throttle_rate,
+                           podcast_bandwidth=options.bandwidth * 1024).start()
+        connect(mock)
+        try:
+            items, job = SCENARIOS[name](catalog, options, workdir)
+            cpu_start = time.process_time()
+            wall_start = time.perf_counter()
+            job()
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+        finally:
+            mock.stop()
+
+    summary = METRICS.summary()['counters']
+    downloads = sum(series['value'] for series in summary.get('zotify_downloads_total', []))
+    skips = sum(series['value'] for series in summary.get('zotify_skips_total', []))
+    failures = sum(series['value'] for series in summary.get('zotify_failures_total', []))
+    return {
+        'scenario': name,
+        'items': items,
+        'downloaded': downloads,
+        'skipped': skips,
+        'failed': failures,
+        'seconds': round(wall, 3),
+        'items_per_min': round(items / wall * 60, 1),
+        'api_calls': mock.api_calls,
+        'api_calls_per_item': round(mock.api_calls / items, 3),
+        'throttled': sum(series['value'] for series in summary.get('zotify_api_throttled_total', [])),
+        'cpu_seconds': round(cpu, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'requests': dict(mock.requests),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks.run', description='Offline zotify throughput benchmarks.')
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help=f'Scenarios to run, all of them by default: {", ".join(SCENARIOS)}.')
+    parser.add_argument('--tracks', type=int, default=1000, help='Tracks in the playlist and liked songs scenarios.')
+    parser.add_argument('--albums', type=int, default=10, help='Albums in the discography scenario.')
+    parser.add_argument('--archived', type=float, default=0.95, help='Share of liked songs downloaded before.')
+    parser.add_argument('--episodes', type=int, default=20, help='Episodes in the podcast scenario.')
+    parser.add_argument('--episode-size', type=int, default=50, help='Size of each episode in MiB.')
+    parser.add_argument('--track-seconds', type=int, default=30, help='Length of the synthetic audio of each track.')
+    parser.add_argument('--bandwidth', type=int, default=0, help='Per stream bandwidth in KiB/s, 0 is unlimited.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds added to every API response.')
+    parser.add_argument('--stream-latency', type=float, default=0.05, help='Seconds taken to open each audio stream.')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of API requests answered with 429.')
+    parser.add_argument('--workers', type=int, default=1, help='Value of WORKERS.')
+    parser.add_argument('--format', default='ogg', help='Value of DOWNLOAD_FORMAT.')
+    parser.add_argument('--genres', action='store_true', help='Enable MD_SAVE_GENRES.')
+    parser.add_argument('--lyrics', action='store_true', help='Enable DOWNLOAD_LYRICS.')
+    parser.add_argument('--pipe', action='store_true', help='Enable FFMPEG_PIPE.')
+    parser.add_argument('--json', help='Also write the results to this file.')
+    options = parser.parse_args()
+    unknown = set(options.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenario: {", ".join(sorted(unknown))}')
+
+    results = []
+    for name in options.scenarios or list(SCENARIOS):
+        # each scenario gets fresh metrics and module level caches
+        for module in [m for m in sys.modules if m == 'zotify' or m.startswith('zotify.')]:
+            del sys.modules[module]
+        result = run(name, options)
+        results.append(result)
+        print(f"{result['scenario']:<12} {result['items']:>6} items  {result['seconds']:>8.2f} s  "
+              f"{result['items_per_min']:>9.1f} items/min  {result['api_calls_per_item']:>6.2f} API calls/item  "
+              f"{result['cpu_seconds']:>7.2f} s CPU  {result['peak_rss_mb']:>7.1f} MiB peak RSS  "
+              f"({result['downloaded']:g} downloaded, {result['skipped']:g} skipped, {result['failed']:g} failed)")
+
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
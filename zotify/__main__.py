@@ -7,8 +7,15 @@ It's like youtube-dl, but for that other music platform.
 
 import argparse
 
-from zotify.app import client
 from zotify.config import CONFIG_VALUES
+from zotify.profiling import profile_run
+
+
+def client(args):
+    # the downloader is only imported once the arguments are known to be valid
+    from zotify.app import client
+    client(args)
+
 
 def main():
     parser = argparse.ArgumentParser(prog='zotify',
@@ -51,6 +58,25 @@ def main():
     group.add_argument('-d', '--download',
                        type=str,
                        help='Downloads tracks, playlists and albums from the URLs written in the file passed.')
+    group.add_argument('--resume',
+                       type=str,
+                       metavar='JOB',
+                       help='Continues an interrupted url download, skipping everything it already finished.')
+    parser.add_argument('--retry-failed',
+                        action='store_true',
+                        help='Also retries the downloads that failed when continuing a job with --resume.')
+    parser.add_argument('--profile',
+                        type=str,
+                        nargs='?',
+                        const='zotify.pstats',
+                        metavar='FILE',
+                        help='Profiles the run with cProfile, writing FILE (zotify.pstats by default) and a collapsed stack file for flame graphs next to it.')
+    parser.add_argument('--trace-malloc',
+                        type=int,
+                        nargs='?',
+                        const=10,
+                        metavar='N',
+                        help='Traces memory allocations with tracemalloc and reports the top N allocators of each download stage (10 by default).')
 
     for configkey in CONFIG_VALUES:
         parser.add_argument(CONFIG_VALUES[configkey]['arg'],
@@ -61,7 +87,8 @@ def main():
     parser.set_defaults(func=client)
 
     args = parser.parse_args()
-    args.func(args)
+    with profile_run(args.profile, args.trace_malloc):
+        args.func(args)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,7 @@
-from zotify.const import ITEMS, ARTISTS, NAME, ID
-from zotify.termoutput import Printer
-from zotify.track import download_track
+from zotify.const import ARTISTS, NAME, ID
+from zotify.journal import JobJournal
+from zotify.pool import DownloadPool
+from zotify.track import download_track, prefetch_song_info
 from zotify.utils import fix_filename
 from zotify.zotify import Zotify
 
@@ -10,18 +11,9 @@ ARTIST_URL = 'https://api.spotify.com/v1/artists'
 
 def get_album_tracks(album_id):
     """ Returns album tracklist """
-    songs = []
-    offset = 0
-    limit = 50
-
-    while True:
-        resp = Zotify.invoke_url_with_params(f'{ALBUM_URL}/{album_id}/tracks', limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
-
-    return songs
+    # album listings only carry simplified tracks, batch the full objects page by page
+    return Zotify.invoke_url_paginated(f'{ALBUM_URL}/{album_id}/tracks', limit=50,
+                                       on_page=lambda songs: prefetch_song_info([song[ID] for song in songs]))
 
 
 def get_album_name(album_id):
@@ -32,27 +24,24 @@ def get_album_name(album_id):
 
 def get_artist_albums(artist_id):
     """ Returns artist's albums """
-    (raw, resp) = Zotify.invoke_url(f'{ARTIST_URL}/{artist_id}/albums?include_groups=album%2Csingle')
-    # Return a list each album's id
-    album_ids = [resp[ITEMS][i][ID] for i in range(len(resp[ITEMS]))]
-    # Recursive requests to get all albums including singles an EPs
-    while resp['next'] is not None:
-        (raw, resp) = Zotify.invoke_url(resp['next'])
-        album_ids.extend([resp[ITEMS][i][ID] for i in range(len(resp[ITEMS]))])
-
-    return album_ids
+    # all albums including singles and EPs, as each album's id
+    return Zotify.invoke_url_paginated(f'{ARTIST_URL}/{artist_id}/albums', limit=50, transform=lambda album: album[ID],
+                                       include_groups='album,single')
 
 
 def download_album(album):
     """ Downloads songs from an album """
     artist, album_name = get_album_name(album)
     tracks = get_album_tracks(album)
-    for n, track in Printer.progress(enumerate(tracks, start=1), unit_scale=True, unit='Song', total=len(tracks)):
-        download_track('album', track[ID], extra_keys={'album_num': str(n).zfill(2), 'artist': artist, 'album': album_name, 'album_id': album}, disable_progressbar=True)
+    with DownloadPool(total=len(tracks), unit='Song') as pool:
+        for n, track in enumerate(tracks, start=1):
+            pool.submit(download_track, 'album', track[ID], extra_keys={'album_num': str(n).zfill(2), 'artist': artist, 'album': album_name, 'album_id': album}, disable_progressbar=True)
 
 
 def download_artist_albums(artist):
     """ Downloads albums of an artist """
     albums = get_artist_albums(artist)
-    for album_id in albums:
-        download_album(album_id)
+    # the artist is only expanded once the tracks of its last album are journaled
+    with JobJournal.expanding():
+        for album_id in albums:
+            download_album(album_id)
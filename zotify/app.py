@@ -1,13 +1,14 @@
-from librespot.audio.decoders import AudioQuality
-from tabulate import tabulate
 from pathlib import Path
 
+from zotify import metrics
 from zotify.album import download_album, download_artist_albums
 from zotify.const import TRACK, NAME, ID, ARTIST, ARTISTS, ITEMS, TRACKS, EXPLICIT, ALBUM, ALBUMS, \
     OWNER, PLAYLIST, PLAYLISTS, DISPLAY_NAME, TYPE
+from zotify.journal import JobJournal, DONE, EXPANDED, FAILED
 from zotify.loader import Loader
 from zotify.playlist import get_playlist_songs, get_playlist_info, download_from_user_playlist, download_playlist
 from zotify.podcast import download_episode, get_show_episodes
+from zotify.pool import DownloadPool
 from zotify.termoutput import Printer, PrintChannel
 from zotify.track import download_track, get_saved_tracks, get_followed_artists
 from zotify.utils import splash, split_input, regex_input_for_urls
@@ -19,17 +20,10 @@ SEARCH_URL = 'https://api.spotify.com/v1/search'
 def client(args) -> None:
     """ Connects to download server to perform query's and get songs to download """
     Zotify(args)
+    metrics.start(Zotify.CONFIG.get_metrics_port(), Zotify.CONFIG.get_metrics_file())
 
     Printer.print(PrintChannel.SPLASH, splash())
 
-    quality_options = {
-        'auto': AudioQuality.VERY_HIGH if Zotify.check_premium() else AudioQuality.HIGH,
-        'normal': AudioQuality.NORMAL,
-        'high': AudioQuality.HIGH,
-        'very_high': AudioQuality.VERY_HIGH
-    }
-    Zotify.DOWNLOAD_QUALITY = quality_options[Zotify.CONFIG.get_download_quality()]
-
     if args.download:
         urls = []
         filename = args.download
@@ -37,7 +31,7 @@ def client(args) -> None:
             with open(filename, 'r', encoding='utf-8') as file:
                 urls.extend([line.strip() for line in file.readlines()])
 
-            download_from_urls(urls)
+            download_job(urls)
 
         else:
             Printer.print(PrintChannel.ERRORS, f'File {filename} not found.\n')
@@ -45,7 +39,16 @@ def client(args) -> None:
 
     if args.urls:
         if len(args.urls) > 0:
-            download_from_urls(args.urls)
+            download_job(args.urls)
+        return
+
+    if args.resume:
+        try:
+            journal = JobJournal.resume(Zotify.CONFIG.get_job_journal_location(), args.resume, args.retry_failed)
+        except ValueError:
+            Printer.print(PrintChannel.ERRORS, f'Job {args.resume} not found.\n')
+            return
+        run_job(journal)
         return
 
     if args.playlist:
@@ -53,11 +56,7 @@ def client(args) -> None:
         return
 
     if args.liked_songs:
-        for song in get_saved_tracks():
-            if not song[TRACK][NAME] or not song[TRACK][ID]:
-                Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###' + "\n")
-            else:
-                download_track('liked', song[TRACK][ID])
+        download_liked_songs()
         return
     
     if args.followed_artists:
@@ -82,6 +81,52 @@ def client(args) -> None:
             search_text = input('Enter search: ')
         search(search_text)
 
+def download_liked_songs() -> None:
+    """ Downloads all the liked songs of the account """
+    saved_tracks = get_saved_tracks()
+    with DownloadPool(total=len(saved_tracks), unit='song') as pool:
+        for song in saved_tracks:
+            if not song[TRACK][NAME] or not song[TRACK][ID]:
+                Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###' + "\n")
+                pool.skip()
+            else:
+                pool.submit(download_track, 'liked', song[TRACK][ID])
+
+
+def download_job(urls: list[str]) -> None:
+    """ Downloads from a list of urls, journaled so that an interrupted run can be resumed """
+    if not Zotify.CONFIG.get_job_journal():
+        download_from_urls(urls)
+        return
+    run_job(JobJournal.create(Zotify.CONFIG.get_job_journal_location(), urls))
+
+
+def run_job(journal: JobJournal) -> None:
+    """ Downloads the urls of a job, skipping what an earlier run of it already finished """
+    Printer.print(PrintChannel.PROGRESS_INFO, f'###   JOB {journal.job_id}, CONTINUE IT WITH --resume {journal.job_id}   ###\n')
+    try:
+        for position, url, state in journal.sources():
+            if state == DONE:
+                continue
+            with journal.source(position):
+                if state in (EXPANDED, FAILED):
+                    # every download of the url is journaled already, no need to expand it again
+                    items = journal.replay(position)
+                    if items:
+                        with DownloadPool(total=len(items), unit='song') as pool:
+                            for item in items:
+                                pool.submit(item)
+                else:
+                    download_from_urls([url])
+
+        failed = journal.counts().get(FAILED, 0)
+    finally:
+        # a finished job is deleted, anything else is kept for --resume
+        journal.close()
+    if failed:
+        Printer.print(PrintChannel.ERRORS, f'###   {failed} DOWNLOADS FAILED, RETRY THEM WITH --resume {journal.job_id} --retry-failed   ###\n')
+
+
 def download_from_urls(urls: list[str]) -> bool:
     """ Downloads from a list of urls """
     download = False
@@ -91,7 +136,7 @@ def download_from_urls(urls: list[str]) -> bool:
 
         if track_id is not None:
             download = True
-            download_track('single', track_id)
+            JobJournal.run(download_track, 'single', track_id)
         elif artist_id is not None:
             download = True
             download_artist_albums(artist_id)
@@ -104,35 +149,40 @@ def download_from_urls(urls: list[str]) -> bool:
             name, _ = get_playlist_info(playlist_id)
             enum = 1
             char_num = len(str(len(playlist_songs)))
-            for song in playlist_songs:
-                if not song[TRACK][NAME] or not song[TRACK][ID]:
-                    Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###' + "\n")
-                else:
-                    if song[TRACK][TYPE] == "episode": # Playlist item is a podcast episode
-                        download_episode(song[TRACK][ID])
+            with DownloadPool(total=len(playlist_songs), unit='song') as pool:
+                for song in playlist_songs:
+                    if not song[TRACK][NAME] or not song[TRACK][ID]:
+                        Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###' + "\n")
+                        pool.skip()
                     else:
-                        download_track('playlist', song[TRACK][ID], extra_keys=
-                        {
-                            'playlist_song_name': song[TRACK][NAME],
-                            'playlist': name,
-                            'playlist_num': str(enum).zfill(char_num),
-                            'playlist_id': playlist_id,
-                            'playlist_track_id': song[TRACK][ID]
-                        })
-                    enum += 1
+                        if song[TRACK][TYPE] == "episode": # Playlist item is a podcast episode
+                            pool.submit(download_episode, song[TRACK][ID])
+                        else:
+                            pool.submit(download_track, 'playlist', song[TRACK][ID], extra_keys=
+                            {
+                                'playlist_song_name': song[TRACK][NAME],
+                                'playlist': name,
+                                'playlist_num': str(enum).zfill(char_num),
+                                'playlist_id': playlist_id,
+                                'playlist_track_id': song[TRACK][ID]
+                            })
+                        enum += 1
         elif episode_id is not None:
             download = True
-            download_episode(episode_id)
+            JobJournal.run(download_episode, episode_id)
         elif show_id is not None:
             download = True
-            for episode in get_show_episodes(show_id):
-                download_episode(episode)
+            episodes = get_show_episodes(show_id)
+            with DownloadPool(total=len(episodes), unit='episode') as pool:
+                for episode in episodes:
+                    pool.submit(download_episode, episode)
 
     return download
 
 
 def search(search_term):
     """ Searches download server's API for relevant data """
+    from tabulate import tabulate
     params = {'limit': '10',
               'offset': '0',
               'q': search_term,
@@ -0,0 +1,125 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+
+from zotify.metrics import METRICS
+from zotify.zotify import Zotify
+
+# concurrent.futures pulls in logging, so it is imported on first use
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+# covers kept in memory, enough for the albums a worker pool has in flight
+MEMORY_CACHE_SIZE = 16
+# cover art is fetched on the side while the audio downloads, started with the first cover
+ARTWORK_EXECUTOR: Optional['ThreadPoolExecutor'] = None
+
+
+class ArtworkCache:
+    """Deduplicating cover art cache.
+
+    Every url is fetched at most once per run: concurrent and repeated
+    requests share one future, the most recent of which are kept in memory.
+    With a directory set, processed covers are also stored there by the
+    sha256 of their content, behind a url index, so later runs reuse them.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = OrderedDict()
+
+    @staticmethod
+    def get_directory() -> Optional[Path]:
+        if not Zotify.CONFIG.get_artwork_cache():
+            return None
+        return Path(Zotify.CONFIG.get_metadata_cache_location()).parent / 'artwork'
+
+    def get_async(self, image_url: str) -> 'Future':
+        global ARTWORK_EXECUTOR
+        with self._lock:
+            future = self._futures.get(image_url)
+            if future is not None:
+                self._futures.move_to_end(image_url)
+                return future
+            if ARTWORK_EXECUTOR is None:
+                from concurrent.futures import ThreadPoolExecutor
+                ARTWORK_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='zotify-artwork')
+            future = ARTWORK_EXECUTOR.submit(self.get, image_url)
+            self._futures[image_url] = future
+            while len(self._futures) > MEMORY_CACHE_SIZE:
+                self._futures.popitem(last=False)
+        future.add_done_callback(lambda f: self._on_done(image_url, f))
+        return future
+
+    def _on_done(self, image_url: str, future: 'Future') -> None:
+        if future.exception() is None:
+            return
+        # failed fetches are retried by the next track instead of being cached
+        with self._lock:
+            if self._futures.get(image_url) is future:
+                del self._futures[image_url]
+
+    def get(self, image_url: str) -> bytes:
+        import hashlib
+        max_size = Zotify.CONFIG.get_artwork_max_size()
+        directory = self.get_directory()
+        if directory is None:
+            with METRICS.timer('zotify_artwork_fetch_seconds', source='network'):
+                return process_artwork(fetch_artwork(image_url), max_size)
+
+        index = directory / 'urls' / hashlib.sha1(f'{image_url}|{max_size}'.encode()).hexdigest()
+        if index.is_file():
+            with METRICS.timer('zotify_artwork_fetch_seconds', source='disk'):
+                digest = index.read_text(encoding='utf-8').strip()
+                blob = directory / 'objects' / digest[:2] / digest
+                if blob.is_file():
+                    return blob.read_bytes()
+
+        with METRICS.timer('zotify_artwork_fetch_seconds', source='network'):
+            img = process_artwork(fetch_artwork(image_url), max_size)
+        digest = hashlib.sha256(img).hexdigest()
+        blob = directory / 'objects' / digest[:2] / digest
+        if not blob.is_file():
+            write_atomic(blob, img)
+        write_atomic(index, digest.encode())
+        return img
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+    temp.write_bytes(data)
+    os.replace(temp, path)
+
+
+def fetch_artwork(image_url: str) -> bytes:
+    """ Downloads cover artwork """
+    response = Zotify.http_get(image_url)
+    # an error page must never be embedded, or cached on disk as the cover
+    response.raise_for_status()
+    return response.content
+
+
+def process_artwork(img: bytes, max_size: int) -> bytes:
+    """ Shrinks and recompresses covers larger than max_size pixels on either side """
+    if not max_size:
+        return img
+    from PIL import Image
+    with Image.open(io.BytesIO(img)) as image:
+        if max(image.size) <= max_size:
+            return img
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+        out = io.BytesIO()
+        image.convert('RGB').save(out, format='JPEG', quality=90, optimize=True)
+    return out.getvalue()
+
+
+ARTWORK_CACHE = ArtworkCache()
+
+
+def fetch_artwork_async(image_url: str) -> 'Future':
+    """ Starts downloading cover artwork in the background, or returns the copy already fetched """
+    return ARTWORK_CACHE.get_async(image_url)
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Any, Awaitable, List, Optional, Tuple
+
+from zotify.cache import get_ttl, make_key
+from zotify.const import LIMIT, OFFSET
+from zotify.metrics import METRICS, endpoint_label
+from zotify.ratelimit import parse_retry_after
+from zotify.zotify import Zotify
+
+# shared by every caller, so API_CONCURRENCY bounds the whole process
+API: Optional['AsyncApi'] = None
+API_LOCK = threading.Lock()
+
+
+class AsyncApi:
+    """Web API client whose requests are coroutines on an httpx.AsyncClient.
+
+    Requests go through the same rate limiter, metadata cache and access token
+    as Zotify.fetch, and are retried the same way. At most concurrency of them
+    are in flight at once, however many coroutines are gathered, and waiting
+    ones cost no thread:
+
+    api = AsyncApi()
+    results = await asyncio.gather(*(api.invoke_url(url) for url in urls))
+
+    The client and its semaphore belong to the event loop they are first used
+    on. Synchronous code runs coroutines on the client's own loop thread with
+    run(), which is what invoke_urls() does.
+    """
+    def __init__(self, concurrency: Optional[int] = None, transport=None):
+        self.concurrency = max(1, concurrency or Zotify.CONFIG.get_api_concurrency())
+        self.transport = transport
+
+        self._client = None
+        self._semaphore = None
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        if self._client is None:
+            import httpx
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._client = httpx.AsyncClient(
+                timeout=Zotify.CONFIG.get_http_timeout() or None,
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                transport=self.transport,
+            )
+        return self._client
+
+    async def api_get(self, url: str, headers: dict, params: Optional[dict] = None):
+        """ Sends an API request through the shared rate limiter, retrying 429s and server errors """
+        client = self.client()
+        limiter = Zotify.rate_limiter()
+        endpoint = endpoint_label(url)
+        attempt = 0
+        throttles = 0
+        while True:
+            await limiter.acquire_async()
+            sent = time.monotonic()
+            async with self._semaphore:
+                with METRICS.timer('zotify_api_request_seconds', endpoint=endpoint):
+                    response = await client.get(url, headers=headers, params=params)
+            METRICS.inc('zotify_api_requests_total', endpoint=endpoint, status=str(response.status_code))
+            if response.status_code == 429 and throttles < Zotify.MAX_THROTTLE_RETRIES:
+                throttles += 1
+                METRICS.inc('zotify_api_throttled_total', endpoint=endpoint)
+                limiter.on_throttle(parse_retry_after(response.headers.get('Retry-After')), sent)
+                continue
+            if response.status_code >= 500 and attempt < Zotify.CONFIG.get_retry_attempts() - 1:
+                METRICS.inc('zotify_api_retries_total', endpoint=endpoint)
+                await asyncio.sleep(limiter.backoff_delay(attempt))
+                attempt += 1
+                continue
+            if response.status_code < 400:
+                limiter.on_success()
+            return response
+
+    async def fetch_with_status(self, url: str, params: Optional[dict] = None) -> Tuple[int, str]:
+        """ Returns the status code and body of an API url, answering from the metadata cache where possible """
+        # the token is refreshed in the background, so this only waits when it already ran out
+        headers = Zotify.get_auth_header()
+        ttl = get_ttl(url) if Zotify.CACHE else None
+        if ttl is None:
+            response = await self.api_get(url, headers, params)
+            return response.status_code, response.text
+
+        key = make_key(url, params, Zotify.CONFIG.get_language())
+        body, etag, fresh = Zotify.CACHE.get(key)
+        if fresh:
+            METRICS.inc('zotify_cache_requests_total', result='hit')
+            return 200, body
+        if etag:
+            headers['If-None-Match'] = etag
+
+        response = await self.api_get(url, headers, params)
+        if response.status_code == 304 and body is not None:
+            METRICS.inc('zotify_cache_requests_total', result='revalidated')
+            Zotify.CACHE.refresh(key, ttl)
+            return 200, body
+        METRICS.inc('zotify_cache_requests_total', result='miss')
+        if response.status_code == 200 and response.text:
+            Zotify.CACHE.put(key, response.text, response.headers.get('ETag'), ttl)
+        return response.status_code, response.text
+
+    async def fetch(self, url: str, params: Optional[dict] = None) -> str:
+        return (await self.fetch_with_status(url, params))[1]
+
+    async def invoke_url(self, url: str) -> Tuple[str, Any]:
+        from zotify.termoutput import Printer, PrintChannel
+        tries = Zotify.CONFIG.get_retry_attempts()
+        for attempt in range(max(1, tries)):
+            status, text = await self.fetch_with_status(url)
+            try:
+                result = json.loads(text)
+            except json.decoder.JSONDecodeError:
+                result = {"error": {"status": "unknown", "message": "received an empty response"}}
+            if result and 'error' not in result:
+                break
+            # api_get already retried server errors
+            if status >= 500 or attempt >= tries - 1:
+                Printer.print(PrintChannel.API_ERRORS, f"Spotify API Error ({result['error']['status']}): {result['error']['message']}")
+                break
+            Printer.print(PrintChannel.WARNINGS, f"Spotify API Error (try {attempt + 1}) ({result['error']['status']}): {result['error']['message']}")
+            await asyncio.sleep(Zotify.rate_limiter().backoff_delay(attempt))
+        return text, result
+
+    async def invoke_url_with_params(self, url: str, limit, offset, **kwargs) -> Any:
+        params = {LIMIT: limit, OFFSET: offset}
+        params.update(kwargs)
+        return json.loads(await self.fetch(url, params))
+
+    async def invoke_urls(self, urls: List[str]) -> List[Tuple[str, Any]]:
+        return await asyncio.gather(*(self.invoke_url(url) for url in urls))
+
+    def run(self, coroutine: Awaitable):
+        """ Runs a coroutine on the client's event loop thread from synchronous code, returning its result """
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name='zotify-api', daemon=True).start()
+                    self._loop = loop
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+
+def get_api() -> AsyncApi:
+    global API
+    if API is None:
+        with API_LOCK:
+            if API is None:
+                API = AsyncApi()
+    return API
+
+
+def invoke_urls(urls: List[str]) -> List[Tuple[str, Any]]:
+    """ Invokes many API urls concurrently from synchronous code, returning their results in order """
+    # logs in on the calling thread first, it may have to prompt for a password
+    Zotify.get_auth_header()
+    api = get_api()
+    return api.run(api.invoke_urls(urls))
@@ -0,0 +1,108 @@
+import re
+import threading
+import time
+from pathlib import Path, PurePath
+from typing import Optional, Tuple
+
+DAY = 24 * 60 * 60
+
+# seconds a cached response stays fresh, first match wins and unmatched urls
+# (search, pathfinder queries with signed audio urls, ...) are never cached
+CACHE_TTLS = [
+    (re.compile(r'^https://api\.spotify\.com/v1/me/'), 60),
+    (re.compile(r'^https://api\.spotify\.com/v1/playlists'), 10 * 60),
+    (re.compile(r'^https://api\.spotify\.com/v1/artists/[^/?]+/albums'), DAY),
+    (re.compile(r'^https://api\.spotify\.com/v1/artists'), 7 * DAY),
+    (re.compile(r'^https://api\.spotify\.com/v1/shows'), DAY),
+    (re.compile(r'^https://api\.spotify\.com/v1/episodes'), 7 * DAY),
+    (re.compile(r'^https://api\.spotify\.com/v1/(tracks|albums|audio-features)'), 30 * DAY),
+    (re.compile(r'^https://spclient\.wg\.spotify\.com/color-lyrics/'), 30 * DAY),
+]
+
+
+def get_ttl(url: str) -> Optional[int]:
+    for pattern, ttl in CACHE_TTLS:
+        if pattern.search(url):
+            return ttl
+    return None
+
+
+def make_key(url: str, params: Optional[dict], language: str) -> str:
+    if params:
+        url += '?' + '&'.join(f'{k}={params[k]}' for k in sorted(params))
+    return f'{language}|{url}'
+
+
+class MetadataCache:
+    """Persistent cache of Web API responses.
+
+    Entries are keyed by url, params and language and expire after a per
+    endpoint TTL. Expired entries that carried an ETag are kept so they can be
+    revalidated, and the least recently used entries are evicted once the
+    stored bodies exceed max_bytes.
+    """
+    def __init__(self, path: PurePath, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        import sqlite3
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                         'key TEXT PRIMARY KEY, body TEXT NOT NULL, etag TEXT, '
+                         'expires REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, key: str) -> Tuple[Optional[str], Optional[str], bool]:
+        """ Returns the cached body, its ETag and whether it is still fresh """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT body, etag, expires FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None, None, False
+            body, etag, expires = row
+            if expires < now:
+                self.misses += 1
+                return body, etag, False
+            self.hits += 1
+            self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        return body, etag, True
+
+    def put(self, key: str, body: str, etag: Optional[str], ttl: int) -> None:
+        now = time.time()
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            row = self._db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO responses (key, body, etag, expires, accessed, size) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', (key, body, etag, now + ttl, now, size))
+            self._size += size - (row[0] if row else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def refresh(self, key: str, ttl: int) -> None:
+        """ Marks an entry fresh again after the server answered 304 Not Modified """
+        now = time.time()
+        with self._lock:
+            self.revalidated += 1
+            self._db.execute('UPDATE responses SET expires = ?, accessed = ? WHERE key = ?', (now + ttl, now, key))
+
+    def _evict(self) -> None:
+        # drop least recently used entries until we are back to 90% of the budget
+        target = self.max_bytes * 0.9
+        rows = self._db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._db.executemany('DELETE FROM responses WHERE key = ?', evicted)
@@ -36,6 +36,24 @@ PRINT_WARNINGS = 'PRINT_WARNINGS'
 RETRY_ATTEMPTS = 'RETRY_ATTEMPTS'
 CONFIG_VERSION = 'CONFIG_VERSION'
 DOWNLOAD_LYRICS = 'DOWNLOAD_LYRICS'
+WORKERS = 'WORKERS'
+TRANSCODE_WORKERS = 'TRANSCODE_WORKERS'
+METADATA_CACHE = 'METADATA_CACHE'
+METADATA_CACHE_LOCATION = 'METADATA_CACHE_LOCATION'
+METADATA_CACHE_SIZE = 'METADATA_CACHE_SIZE'
+HTTP_POOL_SIZE = 'HTTP_POOL_SIZE'
+HTTP_TIMEOUT = 'HTTP_TIMEOUT'
+API_RATE_LIMIT = 'API_RATE_LIMIT'
+FFMPEG_PIPE = 'FFMPEG_PIPE'
+ARTWORK_CACHE = 'ARTWORK_CACHE'
+ARTWORK_MAX_SIZE = 'ARTWORK_MAX_SIZE'
+PODCAST_SEGMENTS = 'PODCAST_SEGMENTS'
+JOB_JOURNAL = 'JOB_JOURNAL'
+JOB_JOURNAL_LOCATION = 'JOB_JOURNAL_LOCATION'
+SESSION_POOL_SIZE = 'SESSION_POOL_SIZE'
+API_CONCURRENCY = 'API_CONCURRENCY'
+METRICS_PORT = 'METRICS_PORT'
+METRICS_FILE = 'METRICS_FILE'
 
 CONFIG_VALUES = {
     SAVE_CREDENTIALS:           { 'default': 'True',  'type': bool, 'arg': '--save-credentials'           },
@@ -55,7 +73,7 @@ CONFIG_VALUES = {
     SKIP_EXISTING:              { 'default': 'True',  'type': bool, 'arg': '--skip-existing'              },
     SKIP_PREVIOUSLY_DOWNLOADED: { 'default': 'False', 'type': bool, 'arg': '--skip-previously-downloaded' },
     RETRY_ATTEMPTS:             { 'default': '1',     'type': int,  'arg': '--retry-attempts'             },
-    BULK_WAIT_TIME:             { 'default': '1',     'type': int,  'arg': '--bulk-wait-time'             },
+    BULK_WAIT_TIME:             { 'default': '0',     'type': int,  'arg': '--bulk-wait-time'             },
     OVERRIDE_AUTO_WAIT:         { 'default': 'False', 'type': bool, 'arg': '--override-auto-wait'         },
     CHUNK_SIZE:                 { 'default': '20000', 'type': int,  'arg': '--chunk-size'                 },
     DOWNLOAD_REAL_TIME:         { 'default': 'False', 'type': bool, 'arg': '--download-real-time'         },
@@ -68,7 +86,25 @@ CONFIG_VALUES = {
     PRINT_API_ERRORS:           { 'default': 'True',  'type': bool, 'arg': '--print-api-errors'           },
     PRINT_PROGRESS_INFO:        { 'default': 'True',  'type': bool, 'arg': '--print-progress-info'        },
     PRINT_WARNINGS:             { 'default': 'True',  'type': bool, 'arg': '--print-warnings'             },
-    TEMP_DOWNLOAD_DIR:          { 'default': '',      'type': str,  'arg': '--temp-download-dir'          }
+    TEMP_DOWNLOAD_DIR:          { 'default': '',      'type': str,  'arg': '--temp-download-dir'          },
+    WORKERS:                    { 'default': '1',     'type': int,  'arg': '--workers'                    },
+    TRANSCODE_WORKERS:          { 'default': '0',     'type': int,  'arg': '--transcode-workers'          },
+    METADATA_CACHE:             { 'default': 'False', 'type': bool, 'arg': '--metadata-cache'             },
+    METADATA_CACHE_LOCATION:    { 'default': '',      'type': str,  'arg': '--metadata-cache-location'    },
+    METADATA_CACHE_SIZE:        { 'default': '256',   'type': int,  'arg': '--metadata-cache-size'        },
+    HTTP_POOL_SIZE:             { 'default': '10',    'type': int,  'arg': '--http-pool-size'             },
+    HTTP_TIMEOUT:               { 'default': '30',    'type': int,  'arg': '--http-timeout'               },
+    API_RATE_LIMIT:             { 'default': '5',     'type': int,  'arg': '--api-rate-limit'             },
+    FFMPEG_PIPE:                { 'default': 'False', 'type': bool, 'arg': '--ffmpeg-pipe'                },
+    ARTWORK_CACHE:              { 'default': 'False', 'type': bool, 'arg': '--artwork-cache'              },
+    ARTWORK_MAX_SIZE:           { 'default': '0',     'type': int,  'arg': '--artwork-max-size'           },
+    PODCAST_SEGMENTS:           { 'default': '4',     'type': int,  'arg': '--podcast-segments'           },
+    JOB_JOURNAL:                { 'default': 'True',  'type': bool, 'arg': '--job-journal'                },
+    JOB_JOURNAL_LOCATION:       { 'default': '',      'type': str,  'arg': '--job-journal-location'       },
+    SESSION_POOL_SIZE:          { 'default': '1',     'type': int,  'arg': '--session-pool-size'          },
+    API_CONCURRENCY:            { 'default': '8',     'type': int,  'arg': '--api-concurrency'            },
+    METRICS_PORT:               { 'default': '0',     'type': int,  'arg': '--metrics-port'               },
+    METRICS_FILE:               { 'default': '',      'type': str,  'arg': '--metrics-file'               }
 }
 
 OUTPUT_DEFAULT_PLAYLIST = '{playlist}/{artist} - {song_name}.{ext}'
@@ -308,3 +344,101 @@ class Config:
     @classmethod
     def get_retry_attempts(cls) -> int:
         return cls.get(RETRY_ATTEMPTS)
+
+    @classmethod
+    def get_workers(cls) -> int:
+        return cls.get(WORKERS)
+
+    @classmethod
+    def get_transcode_workers(cls) -> int:
+        return cls.get(TRANSCODE_WORKERS)
+
+    @classmethod
+    def get_metadata_cache(cls) -> bool:
+        return cls.get(METADATA_CACHE)
+
+    @classmethod
+    def get_metadata_cache_location(cls) -> PurePath:
+        if cls.get(METADATA_CACHE_LOCATION) == '':
+            system_paths = {
+                'win32': Path.home() / 'AppData/Roaming/Zotify',
+                'linux': Path.home() / '.config/zotify',
+                'darwin': Path.home() / 'Library/Application Support/Zotify'
+            }
+            if sys.platform not in system_paths:
+                cache_location = PurePath(Path.cwd() / '.zotify/metadata_cache.sqlite')
+            else:
+                cache_location = PurePath(system_paths[sys.platform] / 'metadata_cache.sqlite')
+        else:
+            cache_location = PurePath(Path(cls.get(METADATA_CACHE_LOCATION)).expanduser())
+        Path(cache_location.parent).mkdir(parents=True, exist_ok=True)
+        return cache_location
+
+    @classmethod
+    def get_metadata_cache_size(cls) -> int:
+        return cls.get(METADATA_CACHE_SIZE)
+
+    @classmethod
+    def get_http_pool_size(cls) -> int:
+        return cls.get(HTTP_POOL_SIZE)
+
+    @classmethod
+    def get_http_timeout(cls) -> int:
+        return cls.get(HTTP_TIMEOUT)
+
+    @classmethod
+    def get_api_rate_limit(cls) -> int:
+        return cls.get(API_RATE_LIMIT)
+
+    @classmethod
+    def get_ffmpeg_pipe(cls) -> bool:
+        return cls.get(FFMPEG_PIPE)
+
+    @classmethod
+    def get_artwork_cache(cls) -> bool:
+        return cls.get(ARTWORK_CACHE)
+
+    @classmethod
+    def get_artwork_max_size(cls) -> int:
+        return cls.get(ARTWORK_MAX_SIZE)
+
+    @classmethod
+    def get_podcast_segments(cls) -> int:
+        return cls.get(PODCAST_SEGMENTS)
+
+    @classmethod
+    def get_job_journal(cls) -> bool:
+        return cls.get(JOB_JOURNAL)
+
+    @classmethod
+    def get_job_journal_location(cls) -> PurePath:
+        if cls.get(JOB_JOURNAL_LOCATION) == '':
+            system_paths = {
+                'win32': Path.home() / 'AppData/Roaming/Zotify',
+                'linux': Path.home() / '.config/zotify',
+                'darwin': Path.home() / 'Library/Application Support/Zotify'
+            }
+            if sys.platform not in system_paths:
+                journal_location = PurePath(Path.cwd() / '.zotify/jobs.sqlite')
+            else:
+                journal_location = PurePath(system_paths[sys.platform] / 'jobs.sqlite')
+        else:
+            journal_location = PurePath(Path(cls.get(JOB_JOURNAL_LOCATION)).expanduser())
+        Path(journal_location.parent).mkdir(parents=True, exist_ok=True)
+        return journal_location
+
+    @classmethod
+    def get_session_pool_size(cls) -> int:
+        return cls.get(SESSION_POOL_SIZE)
+
+    @classmethod
+    def get_api_concurrency(cls) -> int:
+        return cls.get(API_CONCURRENCY)
+
+    @classmethod
+    def get_metrics_port(cls) -> int:
+        return cls.get(METRICS_PORT)
+
+    @classmethod
+    def get_metrics_file(cls) -> str:
+        return cls.get(METRICS_FILE)
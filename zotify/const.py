@@ -4,6 +4,8 @@ SAVED_TRACKS_URL = 'https://api.spotify.com/v1/me/tracks'
 
 TRACKS_URL = 'https://api.spotify.com/v1/tracks'
 
+ARTISTS_URL = 'https://api.spotify.com/v1/artists'
+
 TRACK_STATS_URL = 'https://api.spotify.com/v1/audio-features/'
 
 TRACKNUMBER = 'tracknumber'
@@ -34,6 +36,8 @@ TRACK = 'track'
 
 ITEMS = 'items'
 
+TOTAL = 'total'
+
 NAME = 'name'
 
 HREF = 'href'
@@ -62,6 +66,8 @@ DISC_NUMBER = 'disc_number'
 
 SHOW = 'show'
 
+EPISODES = 'episodes'
+
 ERROR = 'error'
 
 EXPLICIT = 'explicit'
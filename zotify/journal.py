@@ -0,0 +1,269 @@
+import datetime
+import functools
+import importlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path, PurePath
+from typing import List, Optional
+
+PENDING = 'pending'
+EXPANDED = 'expanded'
+DOWNLOADING = 'downloading'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JournalItem:
+    """One download of a job: a zotify function and the arguments it was submitted with.
+
+    Calling it runs the download unless an earlier run already finished it and
+    records the outcome in the journal. Work the download hands to another
+    thread through JobJournal.bind() is part of it, so the outcome is only
+    recorded once the last of that work has finished too.
+    """
+    def __init__(self, journal: 'JobJournal', item_id: int, fn, args, kwargs, state: str):
+        self.journal = journal
+        self.item_id = item_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.state = state
+        self.error = None
+        # the download itself plus every stage it handed off and that has not finished yet
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self.state == DONE:
+            return None
+        self.journal.set_state(self, DOWNLOADING)
+        self._running = 1
+        return self._run(self.fn, self.args, self.kwargs)
+
+    def hand_off(self) -> None:
+        """ Counts a stage handed to another thread, the download is not finished before it is """
+        with self._lock:
+            self._running += 1
+
+    def run_stage(self, fn, *args, **kwargs):
+        """ Runs work the download handed to another thread, a failure there fails the download too """
+        return self._run(fn, args, kwargs)
+
+    def _run(self, fn, args, kwargs):
+        previous, JobJournal._local.item = getattr(JobJournal._local, 'item', None), self
+        try:
+            return fn(*args, **kwargs)
+        except BaseException as e:
+            self.error = self.error or str(e) or type(e).__name__
+            raise
+        finally:
+            JobJournal._local.item = previous
+            self._settle()
+
+    def _settle(self) -> None:
+        with self._lock:
+            self._running -= 1
+            finished = self._running == 0
+        if finished:
+            # downloads report most failures by printing them instead of raising
+            self.journal.set_state(self, FAILED if self.error else DONE, self.error)
+
+
+class JobJournal:
+    """Crash-safe record of a bulk download.
+
+    Every url of a job is stored in order together with the downloads it
+    expanded to and their state, in a SQLite database in WAL mode. While a job
+    is active, DownloadPool.submit() and JobJournal.run() route downloads
+    through it, so a resumed job skips finished urls entirely, replays the
+    downloads of urls that were completely expanded without fetching their
+    collections again, skips the downloads already done within a url before
+    any metadata is queried and retries failed downloads only when asked to.
+    """
+    ACTIVE: 'JobJournal' = None
+    _local = threading.local()
+
+    def __init__(self, path: PurePath, job_id: str, retry_failed: bool = False):
+        self.job_id = job_id
+        self.retry_failed = retry_failed
+        self.position = None
+        self._holding = 0
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        import sqlite3
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, created REAL NOT NULL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS sources ('
+                         'job TEXT NOT NULL, position INTEGER NOT NULL, url TEXT NOT NULL, state TEXT NOT NULL, '
+                         'PRIMARY KEY (job, position))')
+        self._db.execute('CREATE TABLE IF NOT EXISTS items ('
+                         'id INTEGER PRIMARY KEY, job TEXT NOT NULL, source INTEGER NOT NULL, fn TEXT NOT NULL, '
+                         'args TEXT NOT NULL, state TEXT NOT NULL, error TEXT, updated REAL NOT NULL, '
+                         'UNIQUE (job, source, fn, args))')
+
+    @classmethod
+    def create(cls, path: PurePath, urls: List[str]) -> 'JobJournal':
+        journal = cls(path, datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f'))
+        with journal._lock:
+            journal._db.execute('BEGIN')
+            journal._db.execute('INSERT INTO jobs (id, created) VALUES (?, ?)', (journal.job_id, time.time()))
+            journal._db.executemany('INSERT INTO sources (job, position, url, state) VALUES (?, ?, ?, ?)',
+                                    [(journal.job_id, position, url, PENDING) for position, url in enumerate(urls)])
+            journal._db.execute('COMMIT')
+        return journal
+
+    @classmethod
+    def resume(cls, path: PurePath, job_id: str, retry_failed: bool = False) -> 'JobJournal':
+        journal = cls(path, job_id, retry_failed)
+        if journal._db.execute('SELECT 1 FROM jobs WHERE id = ?', (job_id,)).fetchone() is None:
+            journal._db.close()
+            raise ValueError(f'Unknown job {job_id}')
+        return journal
+
+    def close(self) -> None:
+        """ Closes the journal, deleting the job first if every url of it is done """
+        with self._lock:
+            unfinished = self._db.execute('SELECT COUNT(*) FROM sources WHERE job = ? AND state != ?',
+                                          (self.job_id, DONE)).fetchone()[0]
+            if not unfinished:
+                # nothing left to resume or retry
+                self._db.execute('BEGIN')
+                self._db.execute('DELETE FROM items WHERE job = ?', (self.job_id,))
+                self._db.execute('DELETE FROM sources WHERE job = ?', (self.job_id,))
+                self._db.execute('DELETE FROM jobs WHERE id = ?', (self.job_id,))
+                self._db.execute('COMMIT')
+            self._db.close()
+
+    def sources(self) -> List[tuple]:
+        """ Returns position, url and state of every url of the job """
+        with self._lock:
+            return self._db.execute('SELECT position, url, state FROM sources WHERE job = ? ORDER BY position',
+                                    (self.job_id,)).fetchall()
+
+    @contextmanager
+    def source(self, position: int):
+        """ Records the downloads submitted inside the block under the url at position
+
+        Once every download of the url is journaled, expanded() marks it
+        expanded, and when the block completes it is marked done, or failed if
+        any of its downloads did not finish. An interrupted url that was not
+        completely expanded stays pending and is expanded again on resume.
+        """
+        self.position = position
+        JobJournal.ACTIVE = self
+        try:
+            yield
+        finally:
+            JobJournal.ACTIVE = None
+        with self._lock:
+            unfinished = self._db.execute('SELECT COUNT(*) FROM items WHERE job = ? AND source = ? AND state != ?',
+                                          (self.job_id, position, DONE)).fetchone()[0]
+            self._db.execute('UPDATE sources SET state = ? WHERE job = ? AND position = ?',
+                             (FAILED if unfinished else DONE, self.job_id, position))
+
+    @classmethod
+    def expanded(cls) -> None:
+        """ Marks the url being downloaded as expanded: every download it leads to is journaled """
+        journal = cls.ACTIVE
+        if journal is None or journal._holding:
+            return
+        with journal._lock:
+            journal._db.execute('UPDATE sources SET state = ? WHERE job = ? AND position = ? AND state = ?',
+                                (EXPANDED, journal.job_id, journal.position, PENDING))
+
+    @classmethod
+    @contextmanager
+    def expanding(cls):
+        """ Holds back expanded() for a url that expands through several collections one after another """
+        journal = cls.ACTIVE
+        if journal is None:
+            yield
+            return
+        journal._holding += 1
+        try:
+            yield
+        finally:
+            journal._holding -= 1
+        cls.expanded()
+
+    def replay(self, position: int) -> List[JournalItem]:
+        """ Returns the downloads of a completely expanded url that still have to run """
+        states = (PENDING, DOWNLOADING, FAILED) if self.retry_failed else (PENDING, DOWNLOADING)
+        with self._lock:
+            rows = self._db.execute(f'SELECT id, fn, args, state FROM items WHERE job = ? AND source = ? '
+                                    f'AND state IN ({", ".join("?" * len(states))}) ORDER BY id',
+                                    (self.job_id, position, *states)).fetchall()
+        items = []
+        for item_id, name, arguments, state in rows:
+            args, kwargs = json.loads(arguments)
+            items.append(JournalItem(self, item_id, resolve(name), args, kwargs, state))
+        return items
+
+    def record(self, fn, args, kwargs) -> JournalItem:
+        """ Returns the journal entry for a download of the current url, adding it if it is new """
+        name = f'{fn.__module__}.{fn.__qualname__}'
+        arguments = json.dumps([list(args), kwargs], sort_keys=True)
+        with self._lock:
+            self._db.execute('INSERT OR IGNORE INTO items (job, source, fn, args, state, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                             (self.job_id, self.position, name, arguments, PENDING, time.time()))
+            item_id, state = self._db.execute('SELECT id, state FROM items WHERE job = ? AND source = ? AND fn = ? AND args = ?',
+                                              (self.job_id, self.position, name, arguments)).fetchone()
+        if state == FAILED and not self.retry_failed:
+            # left alone, it only runs again with --retry-failed
+            state = DONE
+        return JournalItem(self, item_id, fn, args, kwargs, state)
+
+    def set_state(self, item: JournalItem, state: str, error: Optional[str] = None) -> None:
+        item.state = state
+        with self._lock:
+            self._db.execute('UPDATE items SET state = ?, error = ?, updated = ? WHERE id = ?',
+                             (state, error, time.time(), item.item_id))
+
+    def counts(self) -> dict:
+        """ Returns the number of downloads of the job in each state """
+        with self._lock:
+            return dict(self._db.execute('SELECT state, COUNT(*) FROM items WHERE job = ? GROUP BY state',
+                                         (self.job_id,)).fetchall())
+
+    @classmethod
+    def wrap(cls, fn, args, kwargs):
+        """ Returns what DownloadPool should run for a submitted download """
+        if cls.ACTIVE is None or isinstance(fn, JournalItem):
+            return fn, args, kwargs
+        return cls.ACTIVE.record(fn, args, kwargs), (), {}
+
+    @classmethod
+    def run(cls, fn, *args, **kwargs):
+        """ Runs a single download outside of a DownloadPool """
+        fn, args, kwargs = cls.wrap(fn, args, kwargs)
+        cls.expanded()
+        return fn(*args, **kwargs)
+
+    @classmethod
+    def bind(cls, fn):
+        """ Returns fn running on behalf of the download on this thread, for work handed to another thread """
+        item = getattr(cls._local, 'item', None)
+        if item is None:
+            return fn
+        item.hand_off()
+        return functools.partial(item.run_stage, fn)
+
+    @classmethod
+    def report_error(cls, error) -> None:
+        """ Marks the download running on this thread as failed once it returns """
+        item = getattr(cls._local, 'item', None)
+        if item is not None:
+            item.error = str(error) or type(error).__name__
+
+
+def resolve(name: str):
+    """ Returns the zotify function a journal entry was recorded for """
+    module, _, qualname = name.rpartition('.')
+    if not module.startswith('zotify.'):
+        raise ValueError(f'Refusing to run {name} from the job journal')
+    return getattr(importlib.import_module(module), qualname)
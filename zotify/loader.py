@@ -4,7 +4,7 @@
 # imports
 from itertools import cycle
 from shutil import get_terminal_size
-from threading import Thread
+from threading import Thread, current_thread, main_thread
 from time import sleep
 
 from zotify.termoutput import Printer
@@ -46,6 +46,10 @@ class Loader:
         self.done = False
 
     def start(self):
+        # spinners would tear through the multi-bar display of a worker pool
+        if current_thread() is not main_thread():
+            self.done = True
+            return self
         self._thread.start()
         return self
 
@@ -60,6 +64,9 @@ class Loader:
         self.start()
 
     def stop(self):
+        if not self._thread.is_alive():
+            self.done = True
+            return
         self.done = True
         cols = get_terminal_size((80, 20)).columns
         Printer.print_loader(self.channel, "\r" + " " * cols)
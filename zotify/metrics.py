@@ -0,0 +1,189 @@
+import atexit
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# upper bounds of the histogram buckets, in seconds unless listed in BUCKETS
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BUCKETS = {
+    'zotify_download_bytes_per_second': tuple(2 ** n * 1024 for n in range(4, 16)),
+}
+HELP = {
+    'zotify_api_request_seconds': 'Web API request latency by endpoint',
+    'zotify_api_requests_total': 'Web API requests by endpoint and status',
+    'zotify_api_retries_total': 'Web API requests retried after a server error',
+    'zotify_api_throttled_total': 'Web API requests answered with 429',
+    'zotify_cache_requests_total': 'Metadata cache lookups by result',
+    'zotify_stream_open_seconds': 'Time to open an audio stream',
+    'zotify_stream_first_byte_seconds': 'Time from opening an audio stream to its first byte',
+    'zotify_download_bytes_per_second': 'Audio download throughput per file',
+    'zotify_convert_seconds': 'ffmpeg conversion time per file',
+    'zotify_tag_seconds': 'Tagging time per file',
+    'zotify_artwork_fetch_seconds': 'Cover art fetch time by source',
+    'zotify_downloads_total': 'Files downloaded by kind',
+    'zotify_skips_total': 'Downloads skipped by reason',
+    'zotify_failures_total': 'Downloads failed by stage',
+}
+# path segments that are Spotify ids are folded so endpoints stay a small set
+ID_SEGMENT = re.compile(r'^[0-9A-Za-z]{22}$')
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+
+class Metrics:
+    """In-process counters and histograms of a run.
+
+    Series are keyed by name and labels and created on first use:
+
+    METRICS.inc('zotify_skips_total', reason='exists')
+    with METRICS.timer('zotify_convert_seconds'):
+        ...
+
+    render() produces the Prometheus text format served by serve(), summary()
+    the dict written to METRICS_FILE when the run ends.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._started = time.time()
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(BUCKETS.get(name, DEFAULT_BUCKETS))
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f'# HELP {name} {HELP.get(name, name)}')
+                lines.append(f'# TYPE {name} counter')
+                for labels, value in sorted(series.items()):
+                    lines.append(f'{name}{format_labels(labels)} {value:g}')
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f'# HELP {name} {HELP.get(name, name)}')
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{format_labels(labels + (("le", f"{bound:g}"),))} {cumulative}')
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum:g}')
+                    lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                'started': self._started,
+                'duration': time.time() - self._started,
+                'counters': {name: [{'labels': dict(labels), 'value': value} for labels, value in sorted(series.items())]
+                             for name, series in sorted(self._counters.items())},
+                'histograms': {name: [{'labels': dict(labels), 'count': h.count, 'sum': h.sum, 'mean': h.sum / h.count,
+                                       'min': h.min, 'max': h.max} for labels, h in sorted(series.items())]
+                               for name, series in sorted(self._histograms.items())},
+            }
+
+    def write_summary(self, path: str) -> None:
+        Path(path).expanduser().parent.mkdir(parents=True, exist_ok=True)
+        with open(Path(path).expanduser(), 'w', encoding='utf-8') as file:
+            json.dump(self.summary(), file, indent=2)
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def endpoint_label(url: str) -> str:
+    """ Returns the host and path of a url with any Spotify ids replaced by {id} """
+    parts = urlsplit(url)
+    path = '/'.join('{id}' if ID_SEGMENT.match(segment) else segment for segment in parts.path.split('/'))
+    return f'{parts.netloc}{path}'
+
+
+def serve(port: int, host: str = '127.0.0.1') -> 'ThreadingHTTPServer':
+    """ Serves the metrics in the Prometheus text format on http://host:port/metrics """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = METRICS.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # scrapes would otherwise be printed over the progress bars
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='zotify-metrics', daemon=True).start()
+    return server
+
+
+def start(port: int, summary_file: Optional[str]) -> None:
+    """ Starts the configured metrics outputs for this run """
+    if port:
+        serve(port)
+    if summary_file:
+        atexit.register(METRICS.write_summary, summary_file)
+
+
+METRICS = Metrics()
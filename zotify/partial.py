@@ -0,0 +1,110 @@
+import json
+import os
+from pathlib import Path, PurePath
+from typing import Optional
+
+# bytes written between two manifest updates while a download is running
+CHECKPOINT_SIZE = 4 * 1024 * 1024
+
+
+class PartialDownload:
+    """Download kept in a .part file with a JSON manifest so it can be resumed.
+
+    The manifest records what is being downloaded (content id, expected size,
+    quality) and how many bytes of the part file are known to be good. A later
+    attempt at the same content continues from there, anything else starts
+    over:
+
+    part = PartialDownload(filename, track_id, quality)
+    offset = part.resume_offset(total_size)
+    source.seek(offset)
+    with part.open(total_size, offset):
+        downloaded = write_stream(source, part.file, total_size, p_bar, offset=offset, checkpoint=part.checkpoint)
+    if downloaded < total_size:
+        raise IOError('stream ended early')  # keeps the part file to resume from
+    part.complete()
+    """
+    def __init__(self, filename: PurePath, content_id: str, quality: str = ''):
+        self.filename = Path(filename)
+        self.path = Path(f'{filename}.part')
+        self.manifest_path = Path(f'{filename}.part.json')
+        self.content_id = content_id
+        self.quality = quality
+
+        self.file = None
+        self.size = None
+        self.validator = None
+        self._saved = 0
+
+    @property
+    def saved(self) -> Optional[dict]:
+        """ The manifest left by an earlier attempt at the same content, if its part file is still there """
+        try:
+            manifest = json.loads(self.manifest_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+        if manifest.get('id') != self.content_id or manifest.get('quality') != self.quality or not self.path.is_file():
+            return None
+        return manifest
+
+    def resume_offset(self, size: Optional[int]) -> int:
+        """ Returns how many bytes of a download of the given size can be kept """
+        manifest = self.saved
+        if manifest is None or not size or manifest.get('size') != size:
+            return 0
+        return max(0, min(int(manifest.get('written', 0)), self.path.stat().st_size, size))
+
+    def open(self, size: Optional[int], offset: int = 0, validator: Optional[str] = None) -> 'PartialDownload':
+        """ Opens the part file for writing at offset, dropping anything stored past it """
+        self.size = size
+        self.validator = validator
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if offset:
+            self.file = self.path.open('r+b')
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        else:
+            self.file = self.path.open('wb')
+        self._save(offset)
+        return self
+
+    def checkpoint(self, written: int) -> None:
+        """ Records progress every CHECKPOINT_SIZE bytes, so even a killed run can be resumed """
+        if written - self._saved < CHECKPOINT_SIZE:
+            return
+        self.file.flush()
+        self._save(written)
+
+    def close(self) -> None:
+        if self.file is None:
+            return
+        self.file.flush()
+        written = self.file.tell()
+        self.file.close()
+        self.file = None
+        self._save(written)
+
+    def complete(self, filename: Optional[PurePath] = None) -> None:
+        """ Moves the finished download to filename, by default the one it was created for """
+        self.close()
+        os.replace(self.path, filename or self.filename)
+        self.manifest_path.unlink(missing_ok=True)
+
+    def _save(self, written: int) -> None:
+        manifest = {
+            'id': self.content_id,
+            'size': self.size,
+            'written': written,
+            'quality': self.quality,
+            'validator': self.validator,
+        }
+        temp = self.manifest_path.with_name(f'{self.manifest_path.name}.tmp')
+        temp.write_text(json.dumps(manifest), encoding='utf-8')
+        os.replace(temp, self.manifest_path)
+        self._saved = written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
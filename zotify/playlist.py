@@ -1,6 +1,6 @@
-from zotify.const import ITEMS, ID, TRACK, NAME
-from zotify.termoutput import Printer
-from zotify.track import download_track
+from zotify.const import ID, TRACK, NAME, TYPE
+from zotify.pool import DownloadPool
+from zotify.track import download_track, prefetch_song_info
 from zotify.utils import split_input
 from zotify.zotify import Zotify
 
@@ -10,34 +10,13 @@ PLAYLISTS_URL = 'https://api.spotify.com/v1/playlists'
 
 def get_all_playlists():
     """ Returns list of users playlists """
-    playlists = []
-    limit = 50
-    offset = 0
-
-    while True:
-        resp = Zotify.invoke_url_with_params(MY_PLAYLISTS_URL, limit=limit, offset=offset)
-        offset += limit
-        playlists.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
-
-    return playlists
+    return Zotify.invoke_url_paginated(MY_PLAYLISTS_URL, limit=50)
 
 
 def get_playlist_songs(playlist_id):
     """ returns list of songs in a playlist """
-    songs = []
-    offset = 0
-    limit = 100
-
-    while True:
-        resp = Zotify.invoke_url_with_params(f'{PLAYLISTS_URL}/{playlist_id}/tracks', limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
-
-    return songs
+    return Zotify.invoke_url_paginated(f'{PLAYLISTS_URL}/{playlist_id}/tracks', limit=100,
+                                       on_page=lambda songs: prefetch_song_info([song[TRACK][ID] for song in songs if song[TRACK] and song[TRACK].get(TYPE) != 'episode']))
 
 
 def get_playlist_info(playlist_id):
@@ -49,18 +28,21 @@ def get_playlist_info(playlist_id):
 def download_playlist(playlist):
     """Downloads all the songs from a playlist"""
 
-    playlist_songs = [song for song in get_playlist_songs(playlist[ID]) if song[TRACK] is not None and song[TRACK][ID]]
-    p_bar = Printer.progress(playlist_songs, unit='song', total=len(playlist_songs), unit_scale=True)
-    enum = 1
-    for song in p_bar:
-        download_track('extplaylist', song[TRACK][ID], extra_keys={'playlist': playlist[NAME], 'playlist_num': str(enum).zfill(2)}, disable_progressbar=True)
-        p_bar.set_description(song[TRACK][NAME])
-        enum += 1
+    playlist_songs = get_playlist_songs(playlist[ID])
+    with DownloadPool(total=len(playlist_songs), unit='song') as pool:
+        enum = 1
+        for song in playlist_songs:
+            if song[TRACK] is None or not song[TRACK][ID]:
+                pool.skip()
+                continue
+            pool.submit(download_track, 'extplaylist', song[TRACK][ID], extra_keys={'playlist': playlist[NAME], 'playlist_num': str(enum).zfill(2)}, disable_progressbar=True)
+            pool.set_description(song[TRACK][NAME])
+            enum += 1
 
 
 def download_from_user_playlist():
     """ Select which playlist(s) to download """
-    playlists = get_all_playlists()
+    playlists = list(get_all_playlists())
 
     count = 1
     for playlist in playlists:
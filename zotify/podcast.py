@@ -1,24 +1,50 @@
 # import os
 from pathlib import PurePath, Path
-import time
+import re
+import threading
 from typing import Optional, Tuple
 
-from librespot.metadata import EpisodeId
 
-from zotify.const import ERROR, ID, ITEMS, NAME, SHOW, DURATION_MS
+from zotify.const import ERROR, ID, NAME, SHOW, DURATION_MS, EPISODES
 from zotify.termoutput import PrintChannel, Printer
-from zotify.utils import create_download_directory, fix_filename
-from zotify.zotify import Zotify
+from zotify.metrics import METRICS
+from zotify.partial import PartialDownload
+from zotify.utils import create_download_directory, fix_filename, write_stream, seek_stream, stream_start
+from zotify.zotify import Zotify, Paginator
 from zotify.loader import Loader
 
 
 EPISODE_INFO_URL = 'https://api.spotify.com/v1/episodes'
 SHOWS_URL = 'https://api.spotify.com/v1/shows'
 
+# the episodes endpoint accepts up to 50 ids per request
+EPISODES_BATCH_SIZE = 50
+# prefetched episode objects by id, consumed by get_episode_info
+EPISODE_INFO = {}
+# direct downloads are only split into segments of at least this size
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+SEGMENT_CHUNK_SIZE = 256 * 1024
+
+
+def prefetch_episode_info(episode_ids) -> None:
+    """ Fetches metadata for many episodes at once for get_episode_info to consume """
+    missing = [episode_id for episode_id in dict.fromkeys(episode_ids) if episode_id not in EPISODE_INFO]
+
+    batches = [missing[i:i + EPISODES_BATCH_SIZE] for i in range(0, len(missing), EPISODES_BATCH_SIZE)]
+    results = Zotify.invoke_urls([f'{EPISODE_INFO_URL}?ids={",".join(batch)}' for batch in batches])
+    for batch, (raw, info) in zip(batches, results):
+        if not info or EPISODES not in info:
+            continue
+        for episode_id, episode in zip(batch, info[EPISODES]):
+            if episode:
+                EPISODE_INFO[episode_id] = episode
+
 
 def get_episode_info(episode_id_str) -> Tuple[Optional[str], Optional[str]]:
-    with Loader(PrintChannel.PROGRESS_INFO, "Fetching episode information..."):
-        (raw, info) = Zotify.invoke_url(f'{EPISODE_INFO_URL}/{episode_id_str}')
+    info = EPISODE_INFO.pop(episode_id_str, None)
+    if info is None:
+        with Loader(PrintChannel.PROGRESS_INFO, "Fetching episode information..."):
+            (raw, info) = Zotify.invoke_url(f'{EPISODE_INFO_URL}/{episode_id_str}')
     if not info:
         Printer.print(PrintChannel.ERRORS, "###   INVALID EPISODE ID   ###")
     duration_ms = info[DURATION_MS]
@@ -27,46 +53,126 @@ def get_episode_info(episode_id_str) -> Tuple[Optional[str], Optional[str]]:
     return fix_filename(info[SHOW][NAME]), duration_ms, fix_filename(info[NAME])
 
 
-def get_show_episodes(show_id_str) -> list:
-    episodes = []
-    offset = 0
-    limit = 50
-
+def get_show_episodes(show_id_str) -> Paginator:
     with Loader(PrintChannel.PROGRESS_INFO, "Fetching episodes..."):
-        while True:
-            resp = Zotify.invoke_url_with_params(
-                f'{SHOWS_URL}/{show_id_str}/episodes', limit=limit, offset=offset)
-            offset += limit
-            for episode in resp[ITEMS]:
-                episodes.append(episode[ID])
-            if len(resp[ITEMS]) < limit:
-                break
-
-    return episodes
-
-
-def download_podcast_directly(url, filename):
+        return Zotify.invoke_url_paginated(f'{SHOWS_URL}/{show_id_str}/episodes', limit=50, transform=lambda episode: episode[ID],
+                                           on_page=lambda episodes: prefetch_episode_info([episode[ID] for episode in episodes]))
+
+
+def parse_content_range(content_range: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    """ Returns first byte, last byte and complete size from a Content-Range header like 'bytes 100-199/200' """
+    match = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+)', (content_range or '').strip())
+    return tuple(int(group) for group in match.groups()) if match else None
+
+
+def get_range_size(r) -> Optional[int]:
+    """ Returns the complete size of a partial content response """
+    content_range = parse_content_range(r.headers.get('Content-Range'))
+    return content_range[2] if r.status_code == 206 and content_range else None
+
+
+def download_segment(url, path: Path, start: int, end: int, p_bar, lock: threading.Lock) -> int:
+    """ Downloads bytes start to end of url into the same range of a preallocated file, returns how many it wrote """
+    with Zotify.http_get(url, headers={'Range': f'bytes={start}-{end}', 'Accept-Encoding': 'identity'},
+                         stream=True, allow_redirects=True) as r:
+        if r.status_code != 206 or (parse_content_range(r.headers.get('Content-Range')) or ())[:2] != (start, end):
+            raise RuntimeError(f'Request for bytes {start}-{end} of {url} returned status code {r.status_code}')
+
+        position = start
+        # every segment gets its own handle, the ranges never overlap
+        with path.open('r+b') as file:
+            file.seek(start)
+            for chunk in r.iter_content(chunk_size=SEGMENT_CHUNK_SIZE):
+                file.write(chunk)
+                position += len(chunk)
+                with lock:
+                    p_bar.update(len(chunk))
+    if position != end + 1:
+        raise IOError(f'Segment {start}-{end} of {url} ended after {position - start} bytes')
+    return position - start
+
+
+def download_segmented(url, part: PartialDownload, segments: int) -> bool:
+    """ Downloads url over several connections at once, returns False if the server does not allow it """
+    # a server ignoring the range answers with the whole episode, which must not be read here
+    with Zotify.http_get(url, headers={'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'},
+                         stream=True, allow_redirects=True) as r:
+        file_size = get_range_size(r)
+    if not file_size or file_size < MIN_SEGMENT_SIZE * 2:
+        return False
+
+    from concurrent.futures import ThreadPoolExecutor
+    segments = min(segments, file_size // MIN_SEGMENT_SIZE)
+    segment_size = -(-file_size // segments)
+    lock = threading.Lock()
+    with Printer.progress(desc=part.filename.stem, total=file_size, unit='B', unit_scale=True, unit_divisor=1024) as p_bar:
+        with part.open(file_size):
+            part.file.truncate(file_size)
+        with ThreadPoolExecutor(max_workers=segments, thread_name_prefix='zotify-segment') as executor:
+            futures = [executor.submit(download_segment, url, part.path, start, min(start + segment_size, file_size) - 1, p_bar, lock)
+                       for start in range(0, file_size, segment_size)]
+            written = sum(future.result() for future in futures)
+
+    # the part file was preallocated, so only the segments can tell whether it was filled
+    if written != file_size:
+        raise IOError(f'Downloaded {written} of {file_size} bytes from {url}')
+    part.complete()
+    return True
+
+
+def download_podcast_directly(url, filename, episode_id=None):
     import functools
     import shutil
-    import requests
-    from tqdm.auto import tqdm
 
-    r = requests.get(url, stream=True, allow_redirects=True)
-    if r.status_code != 200:
+    path = Path(filename).expanduser().resolve()
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # the signed url changes between runs, the episode does not
+    part = PartialDownload(path, episode_id or url)
+    saved = part.saved
+    offset = part.resume_offset(saved['size']) if saved else 0
+    if not offset and Zotify.CONFIG.get_podcast_segments() > 1:
+        try:
+            if download_segmented(url, part, Zotify.CONFIG.get_podcast_segments()):
+                return path
+        except Exception as e:
+            Printer.print(PrintChannel.WARNINGS, f'###   Segmented download failed, retrying over a single connection: {e}   ###')
+
+    headers = {}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+        if saved.get('validator'):
+            # the server sends the whole file instead if it changed since
+            headers['If-Range'] = saved['validator']
+
+    r = Zotify.http_get(url, headers=headers, stream=True, allow_redirects=True)
+    if offset and get_range_size(r) == saved['size']:
+        file_size = saved['size']
+    elif r.status_code == 200:
+        offset = 0
+        file_size = int(r.headers.get('Content-Length', 0))
+    else:
         r.raise_for_status()  # Will only raise for 4xx codes, so...
         raise RuntimeError(
             f"Request to {url} returned status code {r.status_code}")
-    file_size = int(r.headers.get('Content-Length', 0))
 
-    path = Path(filename).expanduser().resolve()
-    path.parent.mkdir(parents=True, exist_ok=True)
+    etag = r.headers.get('ETag')
+    # weak etags cannot be used with If-Range
+    validator = etag if etag and not etag.startswith('W/') else r.headers.get('Last-Modified')
 
-    desc = "(Unknown total file size)" if file_size == 0 else ""
+    desc = "(Unknown total file size)" if file_size == 0 else path.stem
     r.raw.read = functools.partial(
         r.raw.read, decode_content=True)  # Decompress if needed
-    with tqdm.wrapattr(r.raw, "read", total=file_size, desc=desc) as r_raw:
-        with path.open("wb") as f:
-            shutil.copyfileobj(r_raw, f)
+    with Printer.progress(desc=desc, total=file_size or None, unit='B', unit_scale=True, unit_divisor=1024,
+                          initial=offset) as p_bar, part.open(file_size or None, offset, validator):
+        if file_size:
+            downloaded = write_stream(r.raw, part.file, file_size, p_bar, offset=offset, checkpoint=part.checkpoint)
+        else:
+            shutil.copyfileobj(r.raw, part.file)
+    if file_size and downloaded < file_size:
+        # the part file and its manifest stay behind for the next attempt to resume
+        raise IOError(f'Download of {url} ended after {downloaded} of {file_size} bytes')
+    part.complete()
 
     return path
 
@@ -78,6 +184,7 @@ def download_episode(episode_id) -> None:
     prepare_download_loader.start()
 
     if podcast_name is None:
+        METRICS.inc('zotify_skips_total', reason='episode not found')
         Printer.print(PrintChannel.SKIPS, '###   SKIPPING: (EPISODE NOT FOUND)   ###')
         prepare_download_loader.stop()
     else:
@@ -92,11 +199,15 @@ def download_episode(episode_id) -> None:
         create_download_directory(download_directory)
 
         if "anon-podcast.scdn.co" in direct_download_url or "audio_preview_url" not in resp:
-            episode_id = EpisodeId.from_base62(episode_id)
-            stream = Zotify.get_content_stream(
-                episode_id, Zotify.DOWNLOAD_QUALITY)
+            from librespot.metadata import EpisodeId
+            with METRICS.timer('zotify_stream_open_seconds'):
+                stream = Zotify.get_content_stream(
+                    EpisodeId.from_base62(episode_id), Zotify.get_download_quality())
 
-            total_size = stream.input_stream.size
+            source = stream.input_stream.stream()
+            # the stream starts after the header librespot skipped, which size still counts
+            start = stream_start(source)
+            total_size = stream.input_stream.size - start
 
             filepath = PurePath(download_directory).joinpath(f"{filename}.ogg")
             if (
@@ -104,35 +215,31 @@ def download_episode(episode_id) -> None:
                 and Path(filepath).stat().st_size == total_size
                 and Zotify.CONFIG.get_skip_existing()
             ):
+                METRICS.inc('zotify_skips_total', reason='episode already exists')
                 Printer.print(PrintChannel.SKIPS, "\n###   SKIPPING: " + podcast_name + " - " + episode_name + " (EPISODE ALREADY EXISTS)   ###")
                 prepare_download_loader.stop()
                 return
 
+            part = PartialDownload(filepath, episode_id, str(Zotify.get_download_quality()))
+            offset = seek_stream(source, part.resume_offset(total_size), start)
+
             prepare_download_loader.stop()
-            time_start = time.time()
-            downloaded = 0
-            with open(filepath, 'wb') as file, Printer.progress(
+            with Printer.progress(
                 desc=filename,
                 total=total_size,
                 unit='B',
                 unit_scale=True,
-                unit_divisor=1024
-            ) as p_bar:
-                prepare_download_loader.stop()
-                while True:
-                #for _ in range(int(total_size / Zotify.CONFIG.get_chunk_size()) + 2):
-                    data = stream.input_stream.stream().read(Zotify.CONFIG.get_chunk_size())
-                    p_bar.update(file.write(data))
-                    downloaded += len(data)
-                    if data == b'':
-                        break
-                    if Zotify.CONFIG.get_download_real_time():
-                        delta_real = time.time() - time_start
-                        delta_want = (downloaded / total_size) * (duration_ms/1000)
-                        if delta_want > delta_real:
-                            time.sleep(delta_want - delta_real)
+                unit_divisor=1024,
+                initial=offset
+            ) as p_bar, part.open(total_size, offset):
+                downloaded = write_stream(source, part.file, total_size, p_bar, duration_ms, offset, part.checkpoint)
+            if downloaded < total_size:
+                # the part file and its manifest stay behind for the next attempt to resume
+                raise IOError(f'Stream ended after {downloaded} of {total_size} bytes')
+            part.complete()
         else:
             filepath = PurePath(download_directory).joinpath(f"{filename}.mp3")
-            download_podcast_directly(direct_download_url, filepath)
+            download_podcast_directly(direct_download_url, filepath, episode_id)
+        METRICS.inc('zotify_downloads_total', kind='episode')
 
     prepare_download_loader.stop()
@@ -0,0 +1,153 @@
+import os
+from queue import Queue
+from threading import BoundedSemaphore, Lock
+
+from zotify.journal import JobJournal
+from zotify.termoutput import Printer
+from zotify.utils import flush_directory_song_ids
+from zotify.zotify import Zotify
+
+
+class DownloadPool:
+    """Bounded pool of download workers.
+
+    Jobs are submitted from the collection loops and run on up to WORKERS
+    threads, each drawing its own progress bar below one aggregate bar:
+
+    with DownloadPool(total=len(tracks), unit='song') as pool:
+        for track in tracks:
+            pool.submit(download_track, 'album', track[ID])
+
+    With a single worker the jobs run inline on the calling thread, like the
+    plain loop they replace, with more they run on a thread pool. Either way
+    the pool is a two stage pipeline: fetching metadata and audio hands the
+    transcode, tag, rename and archive tail to a separate stage through
+    run_stage() so the network keeps moving while ffmpeg runs.
+    """
+    _active = None
+
+    def __init__(self, total=None, unit='song', desc=None):
+        self.workers = max(1, Zotify.CONFIG.get_workers())
+        self.transcode_workers = Zotify.CONFIG.get_transcode_workers() or os.cpu_count() or 1
+        self.total = total
+        self.unit = unit
+        self.desc = desc
+
+        self._executor = None
+        self._transcoder = None
+        self._previous = None
+        self._p_bar = None
+        self._lock = Lock()
+        self._error = None
+        # keep at most a couple of jobs queued per worker so huge collections
+        # are not turned into thousands of pending futures up front
+        self._pending = BoundedSemaphore(self.workers * 2)
+        self._slots = Queue()
+        for slot in range(1, self.workers + 1):
+            self._slots.put(slot)
+        # bounded hand-off queue between the fetch and transcode stages, a full
+        # queue stalls the fetch workers instead of piling up raw files on disk
+        self._stage_slots = BoundedSemaphore(self.transcode_workers * 2)
+
+    @property
+    def concurrent(self) -> bool:
+        return self.workers > 1
+
+    def __enter__(self):
+        # concurrent.futures pulls in logging, zotify --help does not need either
+        from concurrent.futures import ThreadPoolExecutor
+        self._p_bar = Printer.progress(desc=self.desc, total=self.total, unit=self.unit, unit_scale=True, position=0)
+        if self.concurrent:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='zotify-worker')
+        # ffmpeg runs as its own process, so threads waiting on it are enough
+        # to keep every core busy without re-initialising zotify in a child
+        self._transcoder = ThreadPoolExecutor(max_workers=self.transcode_workers, thread_name_prefix='zotify-transcode')
+        self._previous, DownloadPool._active = DownloadPool._active, self
+        return self
+
+    @classmethod
+    def run_stage(cls, fn, *args, **kwargs) -> None:
+        """ Runs the post-download tail of a job on the transcode stage of the active pool, or inline """
+        pool = cls._active
+        fn = JobJournal.bind(fn)
+        if pool is None:
+            fn(*args, **kwargs)
+            return
+
+        pool._stage_slots.acquire()
+        try:
+            future = pool._transcoder.submit(pool._run_stage, fn, args, kwargs)
+        except Exception:
+            pool._stage_slots.release()
+            raise
+        future.add_done_callback(pool._done)
+
+    def _run_stage(self, fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._stage_slots.release()
+
+    def set_description(self, desc) -> None:
+        with self._lock:
+            self._p_bar.set_description(desc)
+
+    def submit(self, fn, *args, **kwargs) -> None:
+        fn, args, kwargs = JobJournal.wrap(fn, args, kwargs)
+        if not self.concurrent:
+            try:
+                fn(*args, **kwargs)
+            finally:
+                self._advance()
+            return
+
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(self._run, fn, args, kwargs)
+        except Exception:
+            self._pending.release()
+            raise
+        future.add_done_callback(self._done)
+
+    def _done(self, future) -> None:
+        # only the first failure is kept, finished futures are not
+        if future.cancelled() or future.exception() is None:
+            return
+        with self._lock:
+            if self._error is None:
+                self._error = future.exception()
+
+    def skip(self) -> None:
+        """ Counts an item that will not be downloaded towards the aggregate bar """
+        self._advance()
+
+    def _run(self, fn, args, kwargs):
+        slot = self._slots.get()
+        Printer.set_slot(slot)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            Printer.set_slot(None)
+            self._slots.put(slot)
+            self._pending.release()
+            self._advance()
+
+    def _advance(self) -> None:
+        with self._lock:
+            self._p_bar.update(1)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None and self._previous is None:
+            # everything has been submitted, so a resumed job can replay it from the journal
+            JobJournal.expanded()
+        # drain the fetch stage first, it is what feeds the transcode stage, but
+        # after an error or Ctrl-C only let the running downloads finish
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=exc_type is not None)
+        self._transcoder.shutdown(wait=True)
+        DownloadPool._active = self._previous
+        flush_directory_song_ids()
+        self._p_bar.close()
+        if exc_type is None and self._error is not None:
+            # surface the first failure the same way the serial loop would have
+            raise self._error
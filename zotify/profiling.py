@@ -0,0 +1,220 @@
+import sys
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+# stacks below this many microseconds are left out of the collapsed file
+MIN_STACK_US = 1
+MAX_STACK_DEPTH = 128
+REPORT_LINES = 25
+
+# set while --trace-malloc is active, mark() is a no-op otherwise
+MEMORY: Optional['MemoryTracer'] = None
+
+
+class CpuProfiler:
+    """cProfile over the whole run, worker threads included.
+
+    Before Python 3.12 a profiler only sees the thread that enabled it, so
+    every thread started during the run gets its own profiler and they are
+    merged when the run ends. From 3.12 one profiler sees every thread.
+    """
+    def __init__(self, path: str):
+        self.path = Path(path).expanduser().with_suffix('.pstats')
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        import cProfile
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._profile_thread)
+        profile.enable()
+
+    def _profile_thread(self, frame, event, arg):
+        # called once, on the first event of each new thread
+        import cProfile
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def stop(self):
+        import pstats
+        threading.setprofile(None)
+        self.profiles[0].disable()
+        stats = pstats.Stats(self.profiles[0])
+        with self._lock:
+            profiles = self.profiles[1:]
+        for profile in profiles:
+            try:
+                stats.add(profile)
+            except TypeError:
+                # the thread ended before making a single call
+                pass
+        return stats
+
+    def write(self, stats) -> Path:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        stats.dump_stats(self.path)
+        collapsed = self.path.with_suffix('.collapsed')
+        with open(collapsed, 'w', encoding='utf-8') as file:
+            for stack, value in sorted(collapsed_stacks(stats).items()):
+                file.write(f'{stack} {value}\n')
+        return collapsed
+
+
+def function_label(func: Tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename == '~':
+        # built-ins have no file, their name says what they are
+        return name.replace(';', ',')
+    return f'{name} ({Path(filename).name}:{line})'.replace(';', ',')
+
+
+def collapsed_stacks(stats) -> Dict[str, int]:
+    """ Rebuilds call stacks from the caller/callee pairs of a profile, in microseconds of own time.
+
+    cProfile keeps no full stacks, so the time of a function called from several
+    places is split between them in proportion to the time each caller spent in it.
+    """
+    callees = defaultdict(dict)
+    roots = []
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees[caller][func] = cumulative
+
+    stacks = Counter()
+
+    def walk(func, path, labels, share):
+        _, _, own, cumulative, _ = stats.stats[func]
+        labels = labels + (function_label(func),)
+        own_us = int(own * share * 1e6)
+        if own_us >= MIN_STACK_US:
+            stacks[';'.join(labels)] += own_us
+        if len(labels) >= MAX_STACK_DEPTH:
+            return
+        for callee, edge in callees[func].items():
+            total = stats.stats[callee][3]
+            callee_share = share * edge / total if total else 0
+            # recursion is folded into the first frame of the function
+            if callee not in path and total * callee_share * 1e6 >= MIN_STACK_US:
+                walk(callee, path | {callee}, labels, callee_share)
+
+    for root in roots:
+        walk(root, {root}, (), 1.0)
+    return stacks
+
+
+class MemoryTracer:
+    """tracemalloc snapshots at the stage boundaries of each download.
+
+    Allocations made on a thread since its previous mark() are added to the
+    stage named by the next one. With several workers the snapshots are of the
+    whole process, so stages running at the same time share their allocations.
+    """
+    def __init__(self, top: int):
+        self.top = top
+        self.stages: Dict[str, Counter] = defaultdict(Counter)
+        self.marks = Counter()
+        self._last = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        import tracemalloc
+        tracemalloc.start()
+
+    def snapshot(self):
+        import tracemalloc
+        return tracemalloc.take_snapshot()
+
+    def mark(self, stage: str) -> None:
+        snapshot = self.snapshot()
+        previous = getattr(self._last, 'snapshot', None)
+        self._last.snapshot = snapshot
+        if previous is None:
+            return
+        diff = snapshot.compare_to(previous, 'lineno')
+        with self._lock:
+            self.marks[stage] += 1
+            allocators = self.stages[stage]
+            for statistic in diff:
+                frame = statistic.traceback[0]
+                if statistic.size_diff and not is_own_frame(frame.filename):
+                    allocators[(frame.filename, frame.lineno)] += statistic.size_diff
+
+    def stop(self) -> str:
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        remaining = self.snapshot().statistics('lineno')
+        tracemalloc.stop()
+
+        lines = [f'Traced memory: {format_size(current)} at exit, {format_size(peak)} peak']
+        with self._lock:
+            for stage, allocators in self.stages.items():
+                lines.append(f'\nStage {stage}: {format_size(sum(allocators.values()))} net over {self.marks[stage]} marks')
+                for (filename, lineno), size in allocators.most_common(self.top):
+                    if size <= 0:
+                        break
+                    lines.append(f'  {format_size(size):>10}  {filename}:{lineno}')
+        lines.append('\nStill allocated at exit:')
+        for statistic in [s for s in remaining if not is_own_frame(s.traceback[0].filename)][:self.top]:
+            frame = statistic.traceback[0]
+            lines.append(f'  {format_size(statistic.size):>10}  {frame.filename}:{frame.lineno} ({statistic.count} blocks)')
+        return '\n'.join(lines)
+
+
+def is_own_frame(filename: str) -> bool:
+    """ Whether an allocation was made by the tracing itself rather than the code traced """
+    import tracemalloc
+    # filtering the snapshots instead would cost more than taking them
+    return filename in (__file__, tracemalloc.__file__) or filename.startswith(('<frozen importlib', '<unknown>'))
+
+
+def format_size(size: float) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size:.0f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GiB'
+
+
+def mark(stage: str) -> None:
+    """ Ends a download stage on the calling thread, when memory is being traced """
+    if MEMORY is not None:
+        MEMORY.mark(stage)
+
+
+@contextmanager
+def profile_run(profile_file: Optional[str], trace_malloc: Optional[int]):
+    """ Profiles the code run inside it as --profile and --trace-malloc ask, reporting to stderr when it ends """
+    global MEMORY
+    if not profile_file and not trace_malloc:
+        yield
+        return
+
+    profiler = CpuProfiler(profile_file) if profile_file else None
+    if trace_malloc:
+        MEMORY = MemoryTracer(trace_malloc)
+        MEMORY.start()
+    if profiler:
+        profiler.start()
+    try:
+        yield
+    finally:
+        if profiler:
+            stats = profiler.stop()
+            collapsed = profiler.write(stats)
+            stats.stream = sys.stderr
+            stats.sort_stats('cumulative').print_stats(REPORT_LINES)
+            print(f'Profile written to {profiler.path}, collapsed stacks for flame graphs to {collapsed}', file=sys.stderr)
+        if MEMORY is not None:
+            report = MEMORY.stop()
+            MEMORY = None
+            print(report, file=sys.stderr)
@@ -0,0 +1,101 @@
+import random
+import threading
+import time
+from typing import Optional
+
+# lowest request rate AIMD will back down to, in requests per second
+MIN_RATE = 0.2
+# rate regained per successful request
+ADDITIVE_STEP = 0.05
+# factor the rate is cut by on every burst of 429s
+DECREASE_FACTOR = 0.5
+# exponential backoff bounds for server errors, in seconds
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    """ Returns the delay a 429 asked for, Spotify sends it in whole seconds """
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return BACKOFF_BASE
+
+
+class RateLimiter:
+    """Token bucket shared by every Web API request.
+
+    Requests take a token before they are sent. The refill rate starts at
+    max_rate, is halved when the API answers 429 and creeps back up with
+    every successful request (AIMD), so concurrent workers settle just under
+    the rate the API actually allows. 429s to requests sent before the last
+    cut belong to the same burst and do not cut it again. A 429 also pauses
+    all callers for the Retry-After period.
+    """
+    def __init__(self, max_rate: float):
+        self.max_rate = max(MIN_RATE, max_rate)
+        self.rate = self.max_rate
+        self.capacity = max(1.0, self.max_rate)
+        self.tokens = self.capacity
+        self.throttled = 0
+
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._decreased_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        """ acquire() for coroutines, waiting without blocking the event loop """
+        import asyncio
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def _take(self) -> float:
+        """ Takes a token, or returns how long to wait before there is one """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + ADDITIVE_STEP)
+
+    def on_throttle(self, retry_after: float, sent: Optional[float] = None) -> None:
+        """ Slows down after a 429 to a request sent at monotonic time sent """
+        with self._lock:
+            self.throttled += 1
+            now = time.monotonic()
+            if sent is None or sent >= self._decreased_at:
+                self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+                self._decreased_at = now
+            self._paused_until = max(self._paused_until, now + retry_after)
+            # no burst once the pause is over
+            self.tokens = 0.0
+            self._updated = max(now, self._paused_until)
+
+    @staticmethod
+    def backoff(attempt: int) -> None:
+        """ Sleeps before retry number attempt + 1 of a failed request """
+        time.sleep(RateLimiter.backoff_delay(attempt))
+
+    @staticmethod
+    def backoff_delay(attempt: int) -> float:
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
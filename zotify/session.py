@@ -0,0 +1,133 @@
+import threading
+import time
+from pathlib import Path, PurePath
+from typing import TYPE_CHECKING, Callable, List, Optional
+
+if TYPE_CHECKING:
+    from librespot.core import Session
+
+# tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 5 * 60
+# librespot keeps handing out its cached token until this close to its expiry
+LIBRESPOT_EXPIRY_MARGIN = 10
+# wait before retrying a failed background refresh
+TOKEN_RETRY_DELAY = 30
+
+
+class SessionManager:
+    """Owns the librespot sessions and the Web API access token.
+
+    The main session is only logged in, by calling login, the first time a
+    token or stream is needed. The token is fetched once and handed out from
+    memory until shortly before it expires, a background thread refreshes it
+    ahead of time so requests never wait on it. Audio streams are spread round
+    robin over a pool of up to pool_size sessions, the extra ones logged in
+    from the stored credentials on a background thread so concurrent downloads
+    do not share one connection, without any stream waiting for them.
+    """
+    def __init__(self, login: Callable[[], 'Session'], scopes: List[str], pool_size: int = 1,
+                 credentials: Optional[PurePath] = None):
+        self.login = login
+        self.scopes = scopes
+        self.pool_size = max(1, pool_size)
+        self.credentials = credentials
+
+        self._token = None
+        self._refresh_at = 0.0
+        self._token_lock = threading.Lock()
+        self._refresher = None
+
+        self._sessions = []
+        self._next = 0
+        self._pool_lock = threading.Lock()
+        self._login_lock = threading.Lock()
+
+    @property
+    def session(self) -> 'Session':
+        """ The main session, logged in on first use """
+        if not self._sessions:
+            with self._login_lock:
+                if not self._sessions:
+                    # login may prompt for a password, so it runs on the thread that needs it
+                    session = self.login()
+                    with self._pool_lock:
+                        self._sessions.insert(0, session)
+                    self.prewarm()
+        return self._sessions[0]
+
+    def prewarm(self) -> None:
+        """ Fetches the token and logs the pooled sessions in on a background thread """
+        threading.Thread(target=self._prewarm, name='zotify-session', daemon=True).start()
+
+    def _prewarm(self) -> None:
+        try:
+            self.token()
+        except Exception:
+            # fetched again on demand, where errors are reported
+            pass
+        try:
+            while self._add_session():
+                pass
+        except Exception:
+            # streams keep using the sessions that did log in
+            pass
+
+    def token(self) -> str:
+        token, refresh_at = self._token, self._refresh_at
+        if token is not None and time.time() < refresh_at:
+            return token
+        with self._token_lock:
+            if self._token is None or time.time() >= self._refresh_at:
+                self._refresh()
+            return self._token
+
+    def _refresh(self) -> None:
+        stored = self.session.tokens().get_token(*self.scopes)
+        # librespot stamps its tokens in microseconds when they are issued, and may
+        # return one it cached long ago, so the expiry must not be counted from now
+        expires = stored.timestamp / 1_000_000 + stored.expires_in
+        refresh_at = expires - TOKEN_REFRESH_MARGIN
+        if refresh_at <= time.time():
+            # still the cached token, which librespot only replaces right before it runs out
+            refresh_at = expires - LIBRESPOT_EXPIRY_MARGIN + 1
+        self._token = stored.access_token
+        self._refresh_at = refresh_at
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name='zotify-token', daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self) -> None:
+        while True:
+            time.sleep(max(1.0, self._refresh_at - time.time()))
+            try:
+                with self._token_lock:
+                    if time.time() >= self._refresh_at:
+                        self._refresh()
+            except Exception:
+                time.sleep(TOKEN_RETRY_DELAY)
+
+    def content_session(self) -> 'Session':
+        """ Returns the session the next audio stream should be loaded from """
+        # logs the main session in first, the pooled ones join as prewarm() logs them in
+        self.session
+        with self._pool_lock:
+            session = self._sessions[self._next % len(self._sessions)]
+            self._next += 1
+        return session
+
+    def _add_session(self) -> bool:
+        if len(self._sessions) >= self.pool_size:
+            return False
+        if self.credentials is None or not Path(self.credentials).is_file():
+            # without stored credentials there is nothing to log more sessions in with
+            return False
+        from librespot.core import Session
+        conf = Session.Configuration.Builder().set_store_credentials(False).build()
+        try:
+            # logging in takes a while, streams keep opening on the sessions already in the pool meanwhile
+            session = Session.Builder(conf).stored_file(str(self.credentials)).create()
+        except RuntimeError:
+            return False
+        with self._pool_lock:
+            self._sessions.append(session)
+        return True
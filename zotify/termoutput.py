@@ -1,6 +1,6 @@
 import sys
+import threading
 from enum import Enum
-from tqdm import tqdm
 
 from zotify.config import *
 from zotify.zotify import Zotify
@@ -21,13 +21,17 @@ ERROR_CHANNEL = [PrintChannel.ERRORS, PrintChannel.API_ERRORS]
 
 
 class Printer:
+    _local = threading.local()
+
     @staticmethod
     def print(channel: PrintChannel, msg: str) -> None:
         if Zotify.CONFIG.get(channel.value):
+            from tqdm import tqdm
+            # tqdm.write keeps messages from tearing through active progress bars
             if channel in ERROR_CHANNEL:
-                print(msg, file=sys.stderr)
+                tqdm.write(msg, file=sys.stderr)
             else:
-                print(msg)
+                tqdm.write(msg, file=sys.stdout)
 
     @staticmethod
     def print_loader(channel: PrintChannel, msg: str) -> None:
@@ -35,7 +39,21 @@ class Printer:
             print(msg, flush=True, end="")
 
     @staticmethod
-    def progress(iterable=None, desc=None, total=None, unit='it', disable=False, unit_scale=False, unit_divisor=1000):
+    def set_slot(slot) -> None:
+        """ Binds the calling worker thread to a line of the multi-bar display """
+        Printer._local.slot = slot
+
+    @staticmethod
+    def get_slot():
+        return getattr(Printer._local, 'slot', None)
+
+    @staticmethod
+    def progress(iterable=None, desc=None, total=None, unit='it', disable=False, unit_scale=False, unit_divisor=1000, position=None, leave=True, initial=0):
+        slot = Printer.get_slot()
+        if slot is not None:
+            # worker threads always draw their own bar below the aggregate one
+            position, leave, disable = slot, False, False
         if not Zotify.CONFIG.get(PrintChannel.DOWNLOAD_PROGRESS.value):
             disable = True
-        return tqdm(iterable=iterable, desc=desc, total=total, disable=disable, unit=unit, unit_scale=unit_scale, unit_divisor=unit_divisor)
+        from tqdm import tqdm
+        return tqdm(iterable=iterable, desc=desc, total=total, disable=disable, unit=unit, unit_scale=unit_scale, unit_divisor=unit_divisor, position=position, leave=leave, initial=initial)
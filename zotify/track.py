@@ -1,39 +1,52 @@
 from pathlib import Path, PurePath
 import math
 import re
+import shutil
+import subprocess
+import threading
 import time
-import uuid
-from typing import Any, Tuple, List
+from typing import TYPE_CHECKING, Any, Optional, Tuple, List
+import json
 
-from librespot.metadata import TrackId
-import ffmpy
-
-from zotify.const import TRACKS, ALBUM, GENRES, NAME, ITEMS, DISC_NUMBER, TRACK_NUMBER, IS_PLAYABLE, ARTISTS, IMAGES, URL, \
-    RELEASE_DATE, ID, TRACKS_URL, FOLLOWED_ARTISTS_URL, SAVED_TRACKS_URL, TRACK_STATS_URL, CODEC_MAP, EXT_MAP, DURATION_MS, \
+from zotify.const import TRACKS, TRACK, ALBUM, GENRES, NAME, ITEMS, DISC_NUMBER, TRACK_NUMBER, IS_PLAYABLE, ARTISTS, IMAGES, URL, \
+    RELEASE_DATE, ID, TRACKS_URL, ARTISTS_URL, FOLLOWED_ARTISTS_URL, SAVED_TRACKS_URL, TRACK_STATS_URL, CODEC_MAP, EXT_MAP, DURATION_MS, \
     HREF, ARTISTS, WIDTH
+from zotify import profiling
 from zotify.termoutput import Printer, PrintChannel
-from zotify.utils import fix_filename, set_audio_tags, set_music_thumbnail, create_download_directory, \
-    get_directory_song_ids, add_to_directory_song_ids, get_previously_downloaded, add_to_archive, fmt_seconds
-from zotify.zotify import Zotify
+from zotify.artwork import fetch_artwork_async
+from zotify.utils import fix_filename, set_audio_tags, create_download_directory, \
+    get_directory_song_ids, get_directory_song_file, add_to_directory_song_ids, get_previously_downloaded, add_to_archive, fmt_seconds, write_stream, seek_stream, stream_start, build_ffmetadata
+from zotify.zotify import Zotify, Paginator
 import traceback
 from zotify.loader import Loader
-
-
-def get_saved_tracks() -> list:
+from zotify.journal import JobJournal
+from zotify.metrics import METRICS
+from zotify.partial import PartialDownload
+from zotify.pool import DownloadPool
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+# output paths claimed by downloads still in flight, so that concurrent
+# workers never settle on the same file name
+RESERVED_PATHS = set()
+RESERVED_PATHS_LOCK = threading.Lock()
+
+# the tracks endpoint accepts up to 50 ids per request
+TRACKS_BATCH_SIZE = 50
+# prefetched track objects by requested id, consumed by get_song_info
+TRACK_INFO = {}
+# the several artists endpoint accepts up to 50 ids per request
+ARTISTS_BATCH_SIZE = 50
+# artist objects by id, kept for the whole run since artists recur across tracks
+ARTIST_INFO = {}
+ARTIST_INFO_LOCK = threading.Lock()
+
+
+def get_saved_tracks() -> Paginator:
     """ Returns user's saved tracks """
-    songs = []
-    offset = 0
-    limit = 50
-
-    while True:
-        resp = Zotify.invoke_url_with_params(
-            SAVED_TRACKS_URL, limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
-
-    return songs
+    return Zotify.invoke_url_paginated(SAVED_TRACKS_URL, limit=50,
+                                       on_page=lambda songs: prefetch_song_info([song[TRACK][ID] for song in songs if song[TRACK]]))
 
 
 def get_followed_artists() -> list:
@@ -46,35 +59,107 @@ def get_followed_artists() -> list:
     return artists
 
 
+def prefetch_song_info(song_ids) -> None:
+    """ Fetches metadata for many tracks at once for get_song_info to consume """
+    missing = [song_id for song_id in dict.fromkeys(song_ids) if song_id and song_id not in TRACK_INFO]
+    if Zotify.CONFIG.get_skip_previously_downloaded():
+        # download_track skips these before asking for their metadata
+        archive = get_previously_downloaded()
+        missing = [song_id for song_id in missing if song_id not in archive]
+
+    batches = [missing[i:i + TRACKS_BATCH_SIZE] for i in range(0, len(missing), TRACKS_BATCH_SIZE)]
+    results = Zotify.invoke_urls([f'{TRACKS_URL}?ids={",".join(batch)}&market=from_token' for batch in batches])
+    artist_ids = []
+    for batch, (raw, info) in zip(batches, results):
+        if not info or TRACKS not in info:
+            # leave the batch to the per-id fallback in get_song_info
+            continue
+        # results come back in request order, relinked tracks carry a different id
+        for song_id, track in zip(batch, info[TRACKS]):
+            if track:
+                TRACK_INFO[song_id] = track
+                artist_ids.extend(artist[ID] for artist in track[ARTISTS])
+
+    if Zotify.CONFIG.get_save_genres():
+        prefetch_artist_info(artist_ids)
+
+
+def prefetch_artist_info(artist_ids) -> None:
+    """ Fetches the artists get_song_genres will need, answering from the metadata cache first """
+    with ARTIST_INFO_LOCK:
+        missing = [artist_id for artist_id in dict.fromkeys(artist_ids) if artist_id and artist_id not in ARTIST_INFO]
+
+    uncached = []
+    for artist_id in missing:
+        body = Zotify.get_cached(f'{ARTISTS_URL}/{artist_id}')
+        if body is None:
+            uncached.append(artist_id)
+            continue
+        with ARTIST_INFO_LOCK:
+            ARTIST_INFO[artist_id] = json.loads(body)
+
+    batches = [uncached[i:i + ARTISTS_BATCH_SIZE] for i in range(0, len(uncached), ARTISTS_BATCH_SIZE)]
+    results = Zotify.invoke_urls([f'{ARTISTS_URL}?ids={",".join(batch)}' for batch in batches])
+    for batch, (raw, info) in zip(batches, results):
+        if not info or ARTISTS not in info:
+            # leave the batch to the per-artist fallback in get_song_genres
+            continue
+        for artist_id, artist in zip(batch, info[ARTISTS]):
+            if not artist:
+                continue
+            with ARTIST_INFO_LOCK:
+                ARTIST_INFO[artist_id] = artist
+            # stored per artist so later runs can reuse it whatever the batch looked like
+            Zotify.put_cached(f'{ARTISTS_URL}/{artist_id}', json.dumps(artist))
+
+
+def get_artist_info(artist) -> dict:
+    """ Returns the full artist object for an artist referenced by a track """
+    with ARTIST_INFO_LOCK:
+        artist_info = ARTIST_INFO.get(artist[ID])
+    if artist_info is None:
+        # query artist genres via href, which will be the api url
+        (raw, artist_info) = Zotify.invoke_url(f'{artist[HREF]}')
+        if GENRES not in artist_info:
+            raise ValueError(f'Invalid response from ARTISTS_URL:\n{raw}')
+        with ARTIST_INFO_LOCK:
+            ARTIST_INFO[artist[ID]] = artist_info
+    return artist_info
+
+
 def get_song_info(song_id) -> Tuple[List[str], List[Any], str, str, Any, Any, Any, Any, Any, Any, int]:
     """ Retrieves metadata for downloaded songs """
-    with Loader(PrintChannel.PROGRESS_INFO, "Fetching track information..."):
-        (raw, info) = Zotify.invoke_url(f'{TRACKS_URL}?ids={song_id}&market=from_token')
+    track = TRACK_INFO.pop(song_id, None)
+    raw = track
+    if track is None:
+        with Loader(PrintChannel.PROGRESS_INFO, "Fetching track information..."):
+            (raw, info) = Zotify.invoke_url(f'{TRACKS_URL}?ids={song_id}&market=from_token')
 
-    if not TRACKS in info:
-        raise ValueError(f'Invalid response from TRACKS_URL:\n{raw}')
+        if not TRACKS in info:
+            raise ValueError(f'Invalid response from TRACKS_URL:\n{raw}')
+        track = info[TRACKS][0]
 
     try:
         artists = []
-        for data in info[TRACKS][0][ARTISTS]:
+        for data in track[ARTISTS]:
             artists.append(data[NAME])
 
-        album_name = info[TRACKS][0][ALBUM][NAME]
-        name = info[TRACKS][0][NAME]
-        release_year = info[TRACKS][0][ALBUM][RELEASE_DATE].split('-')[0]
-        disc_number = info[TRACKS][0][DISC_NUMBER]
-        track_number = info[TRACKS][0][TRACK_NUMBER]
-        scraped_song_id = info[TRACKS][0][ID]
-        is_playable = info[TRACKS][0][IS_PLAYABLE]
-        duration_ms = info[TRACKS][0][DURATION_MS]
-
-        image = info[TRACKS][0][ALBUM][IMAGES][0]
-        for i in info[TRACKS][0][ALBUM][IMAGES]:
+        album_name = track[ALBUM][NAME]
+        name = track[NAME]
+        release_year = track[ALBUM][RELEASE_DATE].split('-')[0]
+        disc_number = track[DISC_NUMBER]
+        track_number = track[TRACK_NUMBER]
+        scraped_song_id = track[ID]
+        is_playable = track[IS_PLAYABLE]
+        duration_ms = track[DURATION_MS]
+
+        image = track[ALBUM][IMAGES][0]
+        for i in track[ALBUM][IMAGES]:
             if i[WIDTH] > image[WIDTH]:
                 image = i
         image_url = image[URL]
 
-        return artists, info[TRACKS][0][ARTISTS], album_name, name, image_url, release_year, disc_number, track_number, scraped_song_id, is_playable, duration_ms
+        return artists, track[ARTISTS], album_name, name, image_url, release_year, disc_number, track_number, scraped_song_id, is_playable, duration_ms
     except Exception as e:
         raise ValueError(f'Failed to parse TRACKS_URL response: {str(e)}\n{raw}')
 
@@ -83,10 +168,10 @@ def get_song_genres(rawartists: List[str], track_name: str) -> List[str]:
     if Zotify.CONFIG.get_save_genres():
         try:
             genres = []
-            for data in rawartists:
-                # query artist genres via href, which will be the api url
-                with Loader(PrintChannel.PROGRESS_INFO, "Fetching artist information..."):
-                    (raw, artistInfo) = Zotify.invoke_url(f'{data[HREF]}')
+            with Loader(PrintChannel.PROGRESS_INFO, "Fetching artist information..."):
+                prefetch_artist_info([data[ID] for data in rawartists])
+                artistInfos = [get_artist_info(data) for data in rawartists]
+            for artistInfo in artistInfos:
                 if Zotify.CONFIG.get_all_genres() and len(artistInfo[GENRES]) > 0:
                     for genre in artistInfo[GENRES]:
                         genres.append(genre)
@@ -99,7 +184,7 @@ def get_song_genres(rawartists: List[str], track_name: str) -> List[str]:
 
             return genres
         except Exception as e:
-            raise ValueError(f'Failed to parse GENRES response: {str(e)}\n{raw}')
+            raise ValueError(f'Failed to parse GENRES response: {str(e)}')
     else:
         return ['']
 
@@ -148,8 +233,18 @@ def download_track(mode: str, track_id: str, extra_keys=None, disable_progressba
     if extra_keys is None:
         extra_keys = {}
 
+    # most tracks of an incremental sync exist already, so rule them out before any request
+    skip_reason = get_early_skip(mode, track_id, extra_keys)
+    if skip_reason:
+        print_skip(extra_keys.get('playlist_song_name', track_id), skip_reason)
+        # a prefetched entry would otherwise never be consumed
+        TRACK_INFO.pop(track_id, None)
+        return
+
+    profiling.mark('idle')
     prepare_download_loader = Loader(PrintChannel.PROGRESS_INFO, "Preparing download...")
     prepare_download_loader.start()
+    reserved_path = None
 
     try:
         output_template = Zotify.CONFIG.get_output(mode)
@@ -177,130 +272,235 @@ def download_track(mode: str, track_id: str, extra_keys=None, disable_progressba
         filename = PurePath(Zotify.CONFIG.get_root_path()).joinpath(output_template)
         filedir = PurePath(filename).parent
 
-        filename_temp = filename
-        if Zotify.CONFIG.get_temp_download_dir() != '':
-            filename_temp = PurePath(Zotify.CONFIG.get_temp_download_dir()).joinpath(f'zotify_{str(uuid.uuid4())}_{track_id}.{ext}')
-
-        check_name = Path(filename).is_file() and Path(filename).stat().st_size
         check_id = scraped_song_id in get_directory_song_ids(filedir)
         check_all_time = scraped_song_id in get_previously_downloaded()
 
-        # a song with the same name is installed
-        if not check_id and check_name:
-            c = len([file for file in Path(filedir).iterdir() if re.search(f'^{filename}_', str(file))]) + 1
+        with RESERVED_PATHS_LOCK:
+            check_name = (Path(filename).is_file() and Path(filename).stat().st_size) or filename in RESERVED_PATHS
+
+            # a song with the same name is installed
+            if not check_id and check_name:
+                c = len([file for file in Path(filedir).iterdir() if re.search(f'^{re.escape(str(filename))}_', str(file))]) + 1
 
-            fname = PurePath(PurePath(filename).name).parent
-            ext = PurePath(PurePath(filename).name).suffix
+                fname = PurePath(filename).stem
+                ext = PurePath(filename).suffix
 
-            filename = PurePath(filedir).joinpath(f'{fname}_{c}{ext}')
+                filename = PurePath(filedir).joinpath(f'{fname}_{c}{ext}')
+                while Path(filename).exists() or filename in RESERVED_PATHS:
+                    c += 1
+                    filename = PurePath(filedir).joinpath(f'{fname}_{c}{ext}')
+
+            RESERVED_PATHS.add(filename)
+            reserved_path = filename
+
+        filename_temp = filename
+        if Zotify.CONFIG.get_temp_download_dir() != '':
+            # named after the output path so an interrupted download is found again by the next run
+            import hashlib
+            path_hash = hashlib.sha1(str(filename).encode()).hexdigest()[:16]
+            filename_temp = PurePath(Zotify.CONFIG.get_temp_download_dir()).joinpath(f'zotify_{path_hash}_{track_id}{PurePath(filename).suffix}')
+        profiling.mark('metadata')
 
     except Exception as e:
-        Printer.print(PrintChannel.ERRORS, '###   SKIPPING SONG - FAILED TO QUERY METADATA   ###')
-        Printer.print(PrintChannel.ERRORS, 'Track_ID: ' + str(track_id))
-        for k in extra_keys:
-            Printer.print(PrintChannel.ERRORS, k + ': ' + str(extra_keys[k]))
-        Printer.print(PrintChannel.ERRORS, "\n")
-        Printer.print(PrintChannel.ERRORS, str(e) + "\n")
-        Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(e).format()) + "\n")
+        print_download_error('###   SKIPPING SONG - FAILED TO QUERY METADATA   ###', track_id, extra_keys, e, 'metadata')
 
     else:
         try:
             if not is_playable:
                 prepare_download_loader.stop()
-                Printer.print(PrintChannel.SKIPS, '\n###   SKIPPING: ' + song_name + ' (SONG IS UNAVAILABLE)   ###' + "\n")
+                print_skip(song_name, 'SONG IS UNAVAILABLE')
             else:
                 if check_id and check_name and Zotify.CONFIG.get_skip_existing():
                     prepare_download_loader.stop()
-                    Printer.print(PrintChannel.SKIPS, '\n###   SKIPPING: ' + song_name + ' (SONG ALREADY EXISTS)   ###' + "\n")
+                    print_skip(song_name, 'SONG ALREADY EXISTS')
 
                 elif check_all_time and Zotify.CONFIG.get_skip_previously_downloaded():
                     prepare_download_loader.stop()
-                    Printer.print(PrintChannel.SKIPS, '\n###   SKIPPING: ' + song_name + ' (SONG ALREADY DOWNLOADED ONCE)   ###' + "\n")
+                    print_skip(song_name, 'SONG ALREADY DOWNLOADED ONCE')
 
                 else:
                     if track_id != scraped_song_id:
                         track_id = scraped_song_id
+                    # fetch the cover while the stream is set up and the audio downloads
+                    artwork = fetch_artwork_async(image_url)
+                    from librespot.metadata import TrackId
                     track = TrackId.from_base62(track_id)
-                    stream = Zotify.get_content_stream(track, Zotify.DOWNLOAD_QUALITY)
+                    with METRICS.timer('zotify_stream_open_seconds'):
+                        stream = Zotify.get_content_stream(track, Zotify.get_download_quality())
                     create_download_directory(filedir)
-                    total_size = stream.input_stream.size
+                    source = stream.input_stream.stream()
+                    # the stream starts after the header librespot skipped, which size still counts
+                    start = stream_start(source)
+                    total_size = stream.input_stream.size - start
+
+                    piped = Zotify.CONFIG.get_ffmpeg_pipe() and ffmpeg_available()
+                    offset = 0
+                    if piped:
+                        # ffmpeg writes the tags as it goes, so they are needed before the audio
+                        genres = get_song_genres(raw_artists, name)
+                    else:
+                        part = PartialDownload(filename_temp, track_id, str(Zotify.get_download_quality()))
+                        offset = seek_stream(source, part.resume_offset(total_size), start)
 
                     prepare_download_loader.stop()
+                    profiling.mark('stream_open')
 
                     time_start = time.time()
-                    downloaded = 0
-                    with open(filename_temp, 'wb') as file, Printer.progress(
+                    with Printer.progress(
                             desc=song_name,
                             total=total_size,
                             unit='B',
                             unit_scale=True,
                             unit_divisor=1024,
-                            disable=disable_progressbar
+                            disable=disable_progressbar,
+                            initial=offset
                     ) as p_bar:
-                        b = 0
-                        while b < 5:
-                        #for _ in range(int(total_size / Zotify.CONFIG.get_chunk_size()) + 2):
-                            data = stream.input_stream.stream().read(Zotify.CONFIG.get_chunk_size())
-                            p_bar.update(file.write(data))
-                            downloaded += len(data)
-                            b += 1 if data == b'' else 0
-                            if Zotify.CONFIG.get_download_real_time():
-                                delta_real = time.time() - time_start
-                                delta_want = (downloaded / total_size) * (duration_ms/1000)
-                                if delta_want > delta_real:
-                                    time.sleep(delta_want - delta_real)
+                        if piped:
+                            # conversion happens while downloading, so this is the whole transfer
+                            with METRICS.timer('zotify_convert_seconds', mode='pipe'):
+                                pipe_to_ffmpeg(source, filename_temp, total_size, p_bar, duration_ms,
+                                               artists, genres, name, album_name, release_year, disc_number, track_number,
+                                               get_artwork(artwork, song_name))
+                        else:
+                            # an interrupted download keeps its part file for the next attempt
+                            with part.open(total_size, offset):
+                                downloaded = write_stream(source, part.file, total_size, p_bar, duration_ms, offset, part.checkpoint)
+                            if downloaded < total_size:
+                                # the part file and its manifest stay behind for the next attempt to resume
+                                raise IOError(f'Stream ended after {downloaded} of {total_size} bytes')
+                            part.complete()
 
                     time_downloaded = time.time()
+                    profiling.mark('download')
 
-                    genres = get_song_genres(raw_artists, name)
+                    if not piped:
+                        genres = get_song_genres(raw_artists, name)
 
                     if(Zotify.CONFIG.get_download_lyrics()):
                         try:
                             get_song_lyrics(track_id, PurePath(str(filename)[:-3] + "lrc"))
                         except ValueError:
                             Printer.print(PrintChannel.SKIPS, f"###   Skipping lyrics for {song_name}: lyrics not available   ###")
-                    convert_audio_format(filename_temp)
-                    try:
-                        set_audio_tags(filename_temp, artists, genres, name, album_name, release_year, disc_number, track_number)
-                        set_music_thumbnail(filename_temp, image_url)
-                    except Exception:
-                        Printer.print(PrintChannel.ERRORS, "Unable to write metadata, ensure ffmpeg is installed and added to your PATH.")
-
-                    if filename_temp != filename:
-                        Path(filename_temp).rename(filename)
-
-                    time_finished = time.time()
+                    profiling.mark('genres_lyrics')
 
-                    Printer.print(PrintChannel.DOWNLOADS, f'###   Downloaded "{song_name}" to "{Path(filename).relative_to(Zotify.CONFIG.get_root_path())}" in {fmt_seconds(time_downloaded - time_start)} (plus {fmt_seconds(time_finished - time_downloaded)} converting)   ###' + "\n")
-
-                    # add song id to archive file
-                    if Zotify.CONFIG.get_skip_previously_downloaded():
-                        add_to_archive(scraped_song_id, PurePath(filename).name, artists[0], name)
-                    # add song id to download directory's .song_ids file
-                    if not check_id:
-                        add_to_directory_song_ids(filedir, scraped_song_id, PurePath(filename).name, artists[0], name)
+                    # the transcode stage owns the reserved path from here on
+                    reserved_path = None
+                    DownloadPool.run_stage(finish_track, track_id, song_name, filename_temp, filename, filedir, check_id,
+                                           artists, genres, name, album_name, release_year, disc_number, track_number,
+                                           artwork, time_start, time_downloaded, extra_keys, piped)
 
                     if Zotify.CONFIG.get_bulk_wait_time():
                         time.sleep(Zotify.CONFIG.get_bulk_wait_time())
         except Exception as e:
-            Printer.print(PrintChannel.ERRORS, '###   SKIPPING: ' + song_name + ' (GENERAL DOWNLOAD ERROR)   ###')
-            Printer.print(PrintChannel.ERRORS, 'Track_ID: ' + str(track_id))
-            for k in extra_keys:
-                Printer.print(PrintChannel.ERRORS, k + ': ' + str(extra_keys[k]))
-            Printer.print(PrintChannel.ERRORS, "\n")
-            Printer.print(PrintChannel.ERRORS, str(e) + "\n")
-            Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(e).format()) + "\n")
+            print_download_error('###   SKIPPING: ' + song_name + ' (GENERAL DOWNLOAD ERROR)   ###', track_id, extra_keys, e, 'download')
             if Path(filename_temp).exists():
                 Path(filename_temp).unlink()
 
+    if reserved_path is not None:
+        release_path(reserved_path)
+
     prepare_download_loader.stop()
 
 
-def convert_audio_format(filename) -> None:
-    """ Converts raw audio into playable file """
-    temp_filename = f'{PurePath(filename).parent}.tmp'
-    Path(filename).replace(temp_filename)
+def get_early_skip(mode: str, track_id: str, extra_keys: dict) -> Optional[str]:
+    """ Returns why a track can be skipped knowing only its id and extra keys, if it can """
+    if Zotify.CONFIG.get_skip_previously_downloaded() and track_id in get_previously_downloaded():
+        return 'SONG ALREADY DOWNLOADED ONCE'
 
+    if Zotify.CONFIG.get_skip_existing():
+        # the directory is known without metadata when only extra keys appear in it
+        output_dir = str(PurePath(Zotify.CONFIG.get_output(mode)).parent)
+        for k in extra_keys:
+            output_dir = output_dir.replace("{"+k+"}", fix_filename(extra_keys[k]))
+        if '{' not in output_dir:
+            filedir = PurePath(Zotify.CONFIG.get_root_path()).joinpath(output_dir)
+            song_file = get_directory_song_file(filedir, track_id)
+            if song_file and Path(filedir, song_file).is_file() and Path(filedir, song_file).stat().st_size:
+                return 'SONG ALREADY EXISTS'
+
+    return None
+
+
+def finish_track(track_id, song_name, filename_temp, filename, filedir, check_id, artists, genres, name, album_name,
+                 release_year, disc_number, track_number, artwork, time_start, time_downloaded, extra_keys, piped=False) -> None:
+    """ Transcodes, tags, renames and archives a fetched track """
+    profiling.mark('idle')
+    time_converting = time.time()
+    try:
+        # piped downloads were converted and tagged by ffmpeg on the way in
+        if not piped:
+            # transcode
+            with METRICS.timer('zotify_convert_seconds', mode='file'):
+                convert_audio_format(filename_temp)
+            profiling.mark('convert')
+
+            # tag and artwork, in one load and save of the file
+            try:
+                cover = get_artwork(artwork, song_name)
+                with METRICS.timer('zotify_tag_seconds'):
+                    set_audio_tags(filename_temp, artists, genres, name, album_name, release_year, disc_number, track_number, cover)
+            except Exception:
+                Printer.print(PrintChannel.ERRORS, "Unable to write metadata, ensure ffmpeg is installed and added to your PATH.")
+            profiling.mark('tag')
+
+        # finalize
+        if filename_temp != filename:
+            Path(filename_temp).rename(filename)
+
+        time_finished = time.time()
+
+        Printer.print(PrintChannel.DOWNLOADS, f'###   Downloaded "{song_name}" to "{Path(filename).relative_to(Zotify.CONFIG.get_root_path())}" in {fmt_seconds(time_downloaded - time_start)} (plus {fmt_seconds(time_finished - time_converting)} converting)   ###' + "\n")
+
+        # add song id to archive file
+        if Zotify.CONFIG.get_skip_previously_downloaded():
+            add_to_archive(track_id, PurePath(filename).name, artists[0], name)
+        # add song id to download directory's .song_ids file
+        if not check_id:
+            add_to_directory_song_ids(filedir, track_id, PurePath(filename).name, artists[0], name)
+        METRICS.inc('zotify_downloads_total', kind='track')
+        profiling.mark('finish')
+    except Exception as e:
+        print_download_error('###   SKIPPING: ' + song_name + ' (GENERAL DOWNLOAD ERROR)   ###', track_id, extra_keys, e, 'finish')
+        if Path(filename_temp).exists():
+            Path(filename_temp).unlink()
+    finally:
+        release_path(filename)
+
+
+def get_artwork(artwork: 'Future', song_name: str) -> Optional[bytes]:
+    """ Waits for a background cover art download, a failed one only costs the cover """
+    try:
+        return artwork.result()
+    except Exception as e:
+        Printer.print(PrintChannel.WARNINGS, f'###   Unable to fetch cover art for {song_name}: {e}   ###')
+        return None
+
+
+def release_path(filename) -> None:
+    """ Frees an output path reserved by download_track """
+    with RESERVED_PATHS_LOCK:
+        RESERVED_PATHS.discard(filename)
+
+
+def print_skip(song_name: str, reason: str) -> None:
+    METRICS.inc('zotify_skips_total', reason=reason.lower())
+    Printer.print(PrintChannel.SKIPS, '\n###   SKIPPING: ' + song_name + ' (' + reason + ')   ###' + "\n")
+
+
+def print_download_error(message: str, track_id: str, extra_keys: dict, e: Exception, stage: str = 'download') -> None:
+    METRICS.inc('zotify_failures_total', stage=stage)
+    JobJournal.report_error(e)
+    Printer.print(PrintChannel.ERRORS, message)
+    Printer.print(PrintChannel.ERRORS, 'Track_ID: ' + str(track_id))
+    for k in extra_keys:
+        Printer.print(PrintChannel.ERRORS, k + ': ' + str(extra_keys[k]))
+    Printer.print(PrintChannel.ERRORS, "\n")
+    Printer.print(PrintChannel.ERRORS, str(e) + "\n")
+    Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(e).format()) + "\n")
+
+
+def get_output_params() -> List[str]:
+    """ Returns the ffmpeg audio codec options for the configured download format """
     download_format = Zotify.CONFIG.get_download_format().lower()
     file_codec = CODEC_MAP.get(download_format, 'copy')
     if file_codec != 'copy':
@@ -318,6 +518,64 @@ def convert_audio_format(filename) -> None:
     output_params = ['-c:a', file_codec]
     if bitrate:
         output_params += ['-b:a', bitrate]
+    return output_params
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which('ffmpeg') is not None
+
+
+def pipe_to_ffmpeg(source, filename, total_size, p_bar, duration_ms, artists, genres, name, album_name,
+                   release_year, disc_number, track_number, artwork) -> None:
+    """ Streams decrypted audio into ffmpeg, which writes the converted and tagged file in one pass """
+    suffix = PurePath(filename).suffix.lower()
+    # ogg has no attached picture stream, covers go into a vorbis comment instead
+    vorbis = suffix == '.ogg'
+    meta_path = f'{filename}.ffmeta'
+    cover_path = f'{filename}.cover'
+
+    with open(meta_path, 'w', encoding='utf-8') as file:
+        file.write(build_ffmetadata(artists, genres, name, album_name, release_year, disc_number, track_number,
+                                    artwork if vorbis else None))
+
+    cmd = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+           '-i', 'pipe:0', '-f', 'ffmetadata', '-i', meta_path]
+    maps = ['-map', '0:a', '-map_metadata', '1', '-map_metadata:s:a:0', '1:g']
+    if artwork is not None and not vorbis:
+        with open(cover_path, 'wb') as file:
+            file.write(artwork)
+        cmd += ['-i', cover_path]
+        maps += ['-map', '2:v', '-c:v', 'copy', '-disposition:v:0', 'attached_pic']
+    if suffix == '.mp3':
+        maps += ['-id3v2_version', '3']
+    cmd += maps + get_output_params() + [str(filename)]
+
+    try:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            write_stream(source, proc.stdin, total_size, p_bar, duration_ms)
+            proc.stdin.close()
+        except BrokenPipeError:
+            # ffmpeg gave up early, its own error below says why
+            pass
+        stderr = proc.communicate()[1]
+        if proc.returncode != 0:
+            raise RuntimeError(f'ffmpeg exited with status {proc.returncode}: {stderr.decode(errors="replace").strip()}')
+    finally:
+        for path in (meta_path, cover_path):
+            if Path(path).exists():
+                Path(path).unlink()
+
+
+def convert_audio_format(filename) -> None:
+    """ Converts raw audio into playable file """
+    import ffmpy
+    # per-file temp name, concurrent workers may be converting in the same directory
+    temp_filename = f'{filename}.tmp'
+    Path(filename).replace(temp_filename)
+
+    output_params = get_output_params()
+    file_codec = output_params[1]
 
     try:
         ff_m = ffmpy.FFmpeg(
@@ -1,21 +1,43 @@
+import atexit
+import base64
 import datetime
 import math
 import os
 import platform
 import re
+import struct
 import subprocess
+import threading
+import time
 from enum import Enum
 from pathlib import Path, PurePath
-from typing import List, Tuple
+from typing import List, Optional, Set, Tuple
 
-import music_tag
-import requests
 
 from zotify.const import ARTIST, GENRE, TRACKTITLE, ALBUM, YEAR, DISCNUMBER, TRACKNUMBER, ARTWORK, \
     WINDOWS_SYSTEM, LINUX_SYSTEM, ALBUMARTIST
+from zotify.metrics import METRICS
+from zotify.termoutput import Printer, PrintChannel
 from zotify.zotify import Zotify
 
 
+# guards the archive and .song_ids appends made by concurrent download workers
+ARCHIVE_LOCK = threading.Lock()
+# song ids of each archive file read so far, by archive path
+ARCHIVE_IDS = {}
+# cached .song_ids indexes, by file path
+SONG_ID_INDEXES = {}
+SONG_IDS_FLUSH_SIZE = 16
+
+# write_stream tuning: chunks grow up to MAX_CHUNK_SIZE while reads take less
+# than FAST_READ seconds and shrink again when one takes longer than SLOW_READ
+MAX_CHUNK_SIZE = 1024 * 1024
+FAST_READ = 0.05
+SLOW_READ = 0.5
+MAX_EMPTY_READS = 5
+PROGRESS_INTERVAL = 0.1
+
+
 class MusicFormat(str, Enum):
     MP3 = 'mp3',
     OGG = 'ogg',
@@ -23,24 +45,35 @@ class MusicFormat(str, Enum):
 
 def create_download_directory(download_path: str) -> None:
     """ Create directory and add a hidden file with song ids """
+    hidden_file_path = PurePath(download_path).joinpath('.song_ids')
+    with ARCHIVE_LOCK:
+        index = SONG_ID_INDEXES.get(str(hidden_file_path))
+        if index is not None and index.stamp is not None:
+            return
+
     Path(download_path).mkdir(parents=True, exist_ok=True)
 
     # add hidden file with song ids
-    hidden_file_path = PurePath(download_path).joinpath('.song_ids')
     if not Path(hidden_file_path).is_file():
-        with open(hidden_file_path, 'w', encoding='utf-8') as f:
+        # append mode so a concurrent worker's first entry is never truncated
+        with open(hidden_file_path, 'a', encoding='utf-8') as f:
             pass
 
 
-def get_previously_downloaded() -> List[str]:
-    """ Returns list of all time downloaded songs """
+def get_previously_downloaded() -> Set[str]:
+    """ Returns set of all time downloaded songs """
 
-    ids = []
     archive_path = Zotify.CONFIG.get_song_archive()
 
-    if Path(archive_path).exists():
-        with open(archive_path, 'r', encoding='utf-8') as f:
-            ids = [line.strip().split('\t')[0] for line in f.readlines()]
+    # the archive is read once per run and then kept in sync by add_to_archive
+    with ARCHIVE_LOCK:
+        ids = ARCHIVE_IDS.get(archive_path)
+        if ids is None:
+            ids = set()
+            if Path(archive_path).exists():
+                with open(archive_path, 'r', encoding='utf-8') as f:
+                    ids.update(line.strip().split('\t')[0] for line in f)
+            ARCHIVE_IDS[archive_path] = ids
 
     return ids
 
@@ -50,35 +83,215 @@ def add_to_archive(song_id: str, filename: str, author_name: str, song_name: str
 
     archive_path = Zotify.CONFIG.get_song_archive()
 
-    if Path(archive_path).exists():
+    with ARCHIVE_LOCK:
         with open(archive_path, 'a', encoding='utf-8') as file:
             file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+        if archive_path in ARCHIVE_IDS:
+            ARCHIVE_IDS[archive_path].add(song_id)
+
+
+class SongIdIndex:
+    """Cached view of one directory's .song_ids file.
+
+    The file is parsed once and re-read only when its mtime or size changes
+    underneath us. New entries are visible immediately but are appended to
+    the file in batches of SONG_IDS_FLUSH_SIZE, or by flush_directory_song_ids.
+    """
+    def __init__(self, hidden_file_path: PurePath):
+        self.path = hidden_file_path
+        self.ids = set()
+        # file name each song was saved under, by song id
+        self.files = {}
+        self.pending = []
+        self.stamp = None
+        self.load()
+
+    def get_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def load(self) -> None:
+        self.stamp = self.get_stamp()
+        self.ids = set()
+        self.files = {}
+        if self.stamp is not None:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    self.parse(line)
+        for line in self.pending:
+            self.parse(line)
+
+    def parse(self, line: str) -> None:
+        fields = line.strip().split('\t')
+        self.ids.add(fields[0])
+        if len(fields) >= 5:
+            self.files[fields[0]] = fields[4]
+
+    def refresh(self) -> None:
+        if self.get_stamp() != self.stamp:
+            self.load()
+
+    def add(self, song_id: str, line: str) -> None:
+        self.parse(line)
+        self.pending.append(line)
+        if len(self.pending) >= SONG_IDS_FLUSH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        # not checking if file exists because we need an exception
+        # to be raised if something is wrong
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.writelines(self.pending)
+        self.pending = []
+        self.stamp = self.get_stamp()
+
+
+def get_song_id_index(download_path: str) -> SongIdIndex:
+    """ Returns the cached index of a download directory, callers must hold ARCHIVE_LOCK """
+    hidden_file_path = PurePath(download_path).joinpath('.song_ids')
+    index = SONG_ID_INDEXES.get(str(hidden_file_path))
+    if index is None:
+        index = SongIdIndex(hidden_file_path)
+        SONG_ID_INDEXES[str(hidden_file_path)] = index
     else:
-        with open(archive_path, 'w', encoding='utf-8') as file:
-            file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+        index.refresh()
+    return index
 
 
-def get_directory_song_ids(download_path: str) -> List[str]:
+def get_directory_song_ids(download_path: str) -> Set[str]:
     """ Gets song ids of songs in directory """
 
-    song_ids = []
+    with ARCHIVE_LOCK:
+        return get_song_id_index(download_path).ids
 
-    hidden_file_path = PurePath(download_path).joinpath('.song_ids')
-    if Path(hidden_file_path).is_file():
-        with open(hidden_file_path, 'r', encoding='utf-8') as file:
-            song_ids.extend([line.strip().split('\t')[0] for line in file.readlines()])
 
-    return song_ids
+def get_directory_song_file(download_path: str, song_id: str) -> Optional[str]:
+    """ Returns the file name a song was saved under in directory, if it was """
+
+    with ARCHIVE_LOCK:
+        return get_song_id_index(download_path).files.get(song_id)
 
 
 def add_to_directory_song_ids(download_path: str, song_id: str, filename: str, author_name: str, song_name: str) -> None:
     """ Appends song_id to .song_ids file in directory """
 
-    hidden_file_path = PurePath(download_path).joinpath('.song_ids')
-    # not checking if file exists because we need an exception
-    # to be raised if something is wrong
-    with open(hidden_file_path, 'a', encoding='utf-8') as file:
-        file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+    with ARCHIVE_LOCK:
+        get_song_id_index(download_path).add(song_id, f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+
+
+def flush_directory_song_ids() -> None:
+    """ Writes out all buffered .song_ids entries """
+
+    with ARCHIVE_LOCK:
+        for index in SONG_ID_INDEXES.values():
+            index.flush()
+
+
+def get_readinto(source):
+    """ Returns source.readinto if it reads the same data as source.read, otherwise None """
+    if not hasattr(source, 'readinto'):
+        return None
+    mro = type(source).__mro__
+    read_owner = next((klass for klass in mro if 'read' in vars(klass)), None)
+    readinto_owner = next((klass for klass in mro if 'readinto' in vars(klass)), None)
+    # a subclass that only overrides read() would leave readinto() on an unrelated base buffer
+    if read_owner is None or readinto_owner is None or not issubclass(readinto_owner, read_owner):
+        return None
+    return source.readinto
+
+
+def stream_start(source) -> int:
+    """ Returns where a freshly opened audio stream is positioned, librespot skips the file header before handing it out """
+    try:
+        # librespot's chunked streams keep their position in pos(), tell() belongs to an unused buffer
+        position = getattr(source, 'pos', None) or source.tell
+        return position()
+    except Exception:
+        return 0
+
+
+def write_stream(source, file, total_size: int, p_bar, duration_ms=None, offset=0, checkpoint=None) -> int:
+    """ Copies total_size bytes of a decrypted audio stream to file from offset on, returns the position reached """
+    chunk_size = min_chunk = max(1, Zotify.CONFIG.get_chunk_size())
+    real_time = Zotify.CONFIG.get_download_real_time() and duration_ms
+    # HTTP bodies read straight into one reused buffer, librespot streams only implement read()
+    readinto = get_readinto(source)
+    buffer = memoryview(bytearray(max(min_chunk, MAX_CHUNK_SIZE))) if readinto else None
+
+    time_start = time.time()
+    last_update = time_start
+    downloaded = offset
+    first_byte = False
+    unreported = 0
+    empty_reads = 0
+    while downloaded < total_size:
+        want = min(chunk_size, total_size - downloaded)
+        time_read = time.time()
+        if readinto:
+            n = readinto(buffer[:want]) or 0
+            file.write(buffer[:n])
+        else:
+            data = source.read(want)
+            n = len(data)
+            file.write(data)
+        now = time.time()
+
+        if n == 0:
+            # the stream may stall on an empty read before more data is decrypted
+            empty_reads += 1
+            if empty_reads >= MAX_EMPTY_READS:
+                break
+            continue
+        empty_reads = 0
+        downloaded += n
+        unreported += n
+        if not first_byte:
+            first_byte = True
+            METRICS.observe('zotify_stream_first_byte_seconds', now - time_start)
+
+        # grow the chunk while full reads come back quickly, shrink it when they stall
+        if n == want and now - time_read < FAST_READ and chunk_size < MAX_CHUNK_SIZE:
+            chunk_size = min(MAX_CHUNK_SIZE, chunk_size * 2)
+        elif now - time_read > SLOW_READ and chunk_size > min_chunk:
+            chunk_size = max(min_chunk, chunk_size // 2)
+
+        if now - last_update >= PROGRESS_INTERVAL:
+            p_bar.update(unreported)
+            unreported = 0
+            last_update = now
+            # lets a resumable download record how far it got
+            if checkpoint:
+                checkpoint(downloaded)
+
+        if real_time:
+            delta_real = now - time_start
+            delta_want = ((downloaded - offset) / total_size) * (duration_ms / 1000)
+            if delta_want > delta_real:
+                time.sleep(delta_want - delta_real)
+
+    p_bar.update(unreported)
+    elapsed = time.time() - time_start
+    if downloaded > offset and elapsed > 0:
+        METRICS.observe('zotify_download_bytes_per_second', (downloaded - offset) / elapsed)
+    return downloaded
+
+
+def seek_stream(source, offset: int, start: int = 0) -> int:
+    """ Moves an audio stream that began at start to where a partial download left off, returns where it ended up """
+    if not offset:
+        return 0
+    try:
+        # seek() is absolute, the header before start was never written to the part file
+        source.seek(start + offset)
+    except Exception as e:
+        Printer.print(PrintChannel.WARNINGS, f'###   Unable to resume download, starting over: {e}   ###')
+        return 0
+    return offset
 
 
 def get_downloaded_song_duration(filename: str) -> float:
@@ -126,8 +339,9 @@ def clear() -> None:
         os.system('clear')
 
 
-def set_audio_tags(filename, artists, genres, name, album_name, release_year, disc_number, track_number) -> None:
-    """ sets music_tag metadata """
+def set_audio_tags(filename, artists, genres, name, album_name, release_year, disc_number, track_number, artwork=None) -> None:
+    """ sets music_tag metadata and cover artwork, loading and saving the file once """
+    import music_tag
     tags = music_tag.load_file(filename)
     tags[ALBUMARTIST] = artists[0]
     tags[ARTIST] = conv_artist_format(artists)
@@ -137,22 +351,48 @@ def set_audio_tags(filename, artists, genres, name, album_name, release_year, di
     tags[YEAR] = release_year
     tags[DISCNUMBER] = disc_number
     tags[TRACKNUMBER] = track_number
+    if artwork is not None:
+        tags[ARTWORK] = artwork
     tags.save()
 
 
+def escape_ffmetadata(value) -> str:
+    """ Escapes a value for an ffmpeg ffmetadata file """
+    return re.sub(r'([=;#\\\n])', r'\\\1', str(value))
+
+
+def build_ffmetadata(artists, genres, name, album_name, release_year, disc_number, track_number, picture=None) -> str:
+    """ Returns an ffmetadata file with the same tags set_audio_tags writes, plus an optional vorbis picture block """
+    tags = {
+        'album_artist': artists[0],
+        'artist': conv_artist_format(artists),
+        'genre': genres[0] if not Zotify.CONFIG.get_all_genres() else Zotify.CONFIG.get_all_genres_delimiter().join(genres),
+        'title': name,
+        'album': album_name,
+        'date': release_year,
+        'disc': disc_number,
+        'track': track_number,
+    }
+    lines = [';FFMETADATA1']
+    lines.extend(f'{key}={escape_ffmetadata(value)}' for key, value in tags.items())
+    if picture is not None:
+        lines.append(f'METADATA_BLOCK_PICTURE={vorbis_picture_block(picture)}')
+    return '\n'.join(lines) + '\n'
+
+
+def vorbis_picture_block(img: bytes) -> str:
+    """ Encodes cover art as the base64 FLAC picture block vorbis comments carry """
+    mime = b'image/png' if img[:8] == b'\x89PNG\r\n\x1a\n' else b'image/jpeg'
+    # front cover, mime, empty description, unknown dimensions, then the image itself
+    block = struct.pack('>II', 3, len(mime)) + mime + struct.pack('>IIIIII', 0, 0, 0, 0, 0, len(img)) + img
+    return base64.b64encode(block).decode('ascii')
+
+
 def conv_artist_format(artists) -> str:
     """ Returns converted artist format """
     return ', '.join(artists)
 
 
-def set_music_thumbnail(filename, image_url) -> None:
-    """ Downloads cover artwork """
-    img = requests.get(image_url).content
-    tags = music_tag.load_file(filename)
-    tags[ARTWORK] = img
-    tags.save()
-
-
 def regex_input_for_urls(search_input) -> Tuple[str, str, str, str, str, str]:
     """ Since many kinds of search may be passed at the command line, process them all here. """
     track_uri_search = re.search(
@@ -287,3 +527,6 @@ def fmt_seconds(secs: float) -> str:
         return f'{m}'.zfill(2) + ':' + f'{s}'.zfill(2)
     else:
         return f'{h}'.zfill(2) + ':' + f'{m}'.zfill(2) + ':' + f'{s}'.zfill(2)
+
+
+atexit.register(flush_directory_song_ids)
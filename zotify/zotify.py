@@ -1,28 +1,54 @@
 import json
+from collections import deque
+from itertools import islice
 from pathlib import Path
-from pwinput import pwinput
+import threading
 import time
-import requests
-from librespot.audio.decoders import VorbisOnlyAudioQuality
-from librespot.core import Session
+from typing import TYPE_CHECKING
 
-from zotify.const import TYPE, \
+from zotify.const import TYPE, ITEMS, TOTAL, \
     PREMIUM, USER_READ_EMAIL, OFFSET, LIMIT, \
     PLAYLIST_READ_PRIVATE, USER_LIBRARY_READ, USER_FOLLOW_READ
 from zotify.config import Config
+from zotify.cache import MetadataCache, get_ttl, make_key
+from zotify.ratelimit import RateLimiter, parse_retry_after
+from zotify.metrics import METRICS, endpoint_label
+from zotify.session import SessionManager
+
+# librespot and requests take most of the startup time, so they are imported on first use
+if TYPE_CHECKING:
+    import requests
+    from librespot.core import Session
 
 class Zotify:    
-    SESSION: Session = None
+    SESSION: 'Session' = None
+    SESSIONS: SessionManager = None
     DOWNLOAD_QUALITY = None
     CONFIG: Config = Config()
+    CACHE: MetadataCache = None
+    HTTP: 'requests.Session' = None
+    HTTP_LOCK = threading.Lock()
+    RATE_LIMITER: RateLimiter = None
+    # 429s are retried after their Retry-After delay, at most this many times per request
+    MAX_THROTTLE_RETRIES = 10
+    # pages of a collection fetched at the same time once its total is known
+    PAGE_FETCH_WORKERS = 4
+    TOKEN_SCOPES = [USER_READ_EMAIL, PLAYLIST_READ_PRIVATE, USER_LIBRARY_READ, USER_FOLLOW_READ]
 
     def __init__(self, args):
         Zotify.CONFIG.load(args)
-        Zotify.login(args)
+        if Zotify.CONFIG.get_metadata_cache():
+            Zotify.CACHE = MetadataCache(Zotify.CONFIG.get_metadata_cache_location(),
+                                         Zotify.CONFIG.get_metadata_cache_size() * 1024 * 1024)
+        # nothing logs in until the first API request or audio stream needs the session
+        Zotify.SESSIONS = SessionManager(lambda: Zotify.login(args), Zotify.TOKEN_SCOPES,
+                                         Zotify.CONFIG.get_session_pool_size(), Config.get_credentials_location())
 
     @classmethod
-    def login(cls, args):
+    def login(cls, args) -> 'Session':
         """ Authenticates with Spotify and saves credentials to a file """
+        from librespot.core import Session
+        from pwinput import pwinput
 
         cred_location = Config.get_credentials_location()
 
@@ -30,7 +56,7 @@ class Zotify:
             try:
                 conf = Session.Configuration.Builder().set_store_credentials(False).build()
                 cls.SESSION = Session.Builder(conf).stored_file(cred_location).create()
-                return
+                return cls.SESSION
             except RuntimeError:
                 pass
         while True:
@@ -44,19 +70,74 @@ class Zotify:
                 else:
                     conf = Session.Configuration.Builder().set_store_credentials(False).build()
                 cls.SESSION = Session.Builder(conf).user_pass(user_name, password).create()
-                return
+                return cls.SESSION
             except RuntimeError:
                 pass
 
+    @classmethod
+    def http(cls) -> 'requests.Session':
+        """ Returns the keep-alive session shared by API, artwork and podcast requests """
+        if cls.HTTP is None:
+            with cls.HTTP_LOCK:
+                if cls.HTTP is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    # urllib3 keeps one pool per host, pool_maxsize connections each
+                    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=cls.CONFIG.get_http_pool_size())
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    cls.HTTP = session
+        return cls.HTTP
+
+    @classmethod
+    def http_get(cls, url, **kwargs) -> 'requests.Response':
+        kwargs.setdefault('timeout', cls.CONFIG.get_http_timeout() or None)
+        return cls.http().get(url, **kwargs)
+
+    @classmethod
+    def rate_limiter(cls) -> RateLimiter:
+        if cls.RATE_LIMITER is None:
+            with cls.HTTP_LOCK:
+                if cls.RATE_LIMITER is None:
+                    cls.RATE_LIMITER = RateLimiter(cls.CONFIG.get_api_rate_limit())
+        return cls.RATE_LIMITER
+
+    @classmethod
+    def api_get(cls, url, headers, params=None) -> 'requests.Response':
+        """ Sends an API request through the shared rate limiter, retrying 429s and server errors """
+        limiter = cls.rate_limiter()
+        endpoint = endpoint_label(url)
+        attempt = 0
+        throttles = 0
+        while True:
+            limiter.acquire()
+            sent = time.monotonic()
+            with METRICS.timer('zotify_api_request_seconds', endpoint=endpoint):
+                response = cls.http_get(url, headers=headers, params=params)
+            METRICS.inc('zotify_api_requests_total', endpoint=endpoint, status=str(response.status_code))
+            if response.status_code == 429 and throttles < cls.MAX_THROTTLE_RETRIES:
+                throttles += 1
+                METRICS.inc('zotify_api_throttled_total', endpoint=endpoint)
+                limiter.on_throttle(parse_retry_after(response.headers.get('Retry-After')), sent)
+                continue
+            if response.status_code >= 500 and attempt < cls.CONFIG.get_retry_attempts() - 1:
+                METRICS.inc('zotify_api_retries_total', endpoint=endpoint)
+                limiter.backoff(attempt)
+                attempt += 1
+                continue
+            if response.status_code < 400:
+                limiter.on_success()
+            return response
+
     @classmethod
     def get_content_stream(cls, content_id, quality):
-        return cls.SESSION.content_feeder().load(content_id, VorbisOnlyAudioQuality(quality), False, None)
+        from librespot.audio.decoders import VorbisOnlyAudioQuality
+        return cls.SESSIONS.content_session().content_feeder().load(content_id, VorbisOnlyAudioQuality(quality), False, None)
 
     @classmethod
     def __get_auth_token(cls):
-        return cls.SESSION.tokens().get_token(
-            USER_READ_EMAIL, PLAYLIST_READ_PRIVATE, USER_LIBRARY_READ, USER_FOLLOW_READ
-        ).access_token
+        return cls.SESSIONS.token()
 
     @classmethod
     def get_auth_header(cls):
@@ -68,36 +149,86 @@ class Zotify:
         }
 
     @classmethod
-    def get_auth_header_and_params(cls, limit, offset):
-        return {
-            'Authorization': f'Bearer {cls.__get_auth_token()}',
-            'Accept-Language': f'{cls.CONFIG.get_language()}',
-            'Accept': 'application/json',
-            'app-platform': 'WebPlayer'
-        }, {LIMIT: limit, OFFSET: offset}
+    def fetch(cls, url, params=None):
+        """ GETs an API url, answering from the metadata cache where possible """
+        return cls.fetch_with_status(url, params)[1]
+
+    @classmethod
+    def fetch_with_status(cls, url, params=None):
+        """ Returns the status code and body of fetch(), cached responses count as 200 """
+        ttl = get_ttl(url) if cls.CACHE else None
+        if ttl is None:
+            response = cls.api_get(url, headers=cls.get_auth_header(), params=params)
+            return response.status_code, response.text
+
+        key = make_key(url, params, cls.CONFIG.get_language())
+        body, etag, fresh = cls.CACHE.get(key)
+        if fresh:
+            METRICS.inc('zotify_cache_requests_total', result='hit')
+            return 200, body
+        headers = cls.get_auth_header()
+        if etag:
+            headers['If-None-Match'] = etag
+
+        response = cls.api_get(url, headers=headers, params=params)
+        if response.status_code == 304 and body is not None:
+            METRICS.inc('zotify_cache_requests_total', result='revalidated')
+            cls.CACHE.refresh(key, ttl)
+            return 200, body
+        METRICS.inc('zotify_cache_requests_total', result='miss')
+        if response.status_code == 200 and response.text:
+            cls.CACHE.put(key, response.text, response.headers.get('ETag'), ttl)
+        return response.status_code, response.text
+
+    @classmethod
+    def get_cached(cls, url):
+        """ Returns the fresh cached response for a url without touching the network """
+        if not cls.CACHE or get_ttl(url) is None:
+            return None
+        body, _, fresh = cls.CACHE.get(make_key(url, None, cls.CONFIG.get_language()))
+        return body if fresh else None
+
+    @classmethod
+    def put_cached(cls, url, body) -> None:
+        """ Caches a response under a url it was not fetched from, like one item of a batch request """
+        ttl = get_ttl(url) if cls.CACHE else None
+        if ttl is not None:
+            cls.CACHE.put(make_key(url, None, cls.CONFIG.get_language()), body, None, ttl)
 
     @classmethod
     def invoke_url_with_params(cls, url, limit, offset, **kwargs):
-        headers, params = cls.get_auth_header_and_params(limit=limit, offset=offset)
+        params = {LIMIT: limit, OFFSET: offset}
         params.update(kwargs)
-        return requests.get(url, headers=headers, params=params).json()
+        return json.loads(cls.fetch(url, params))
+
+    @classmethod
+    def invoke_url_paginated(cls, url, limit, on_page=None, transform=None, **kwargs) -> 'Paginator':
+        """ Returns a lazy iterator over every item of a paginated collection """
+        return Paginator(url, limit, on_page, transform, kwargs)
+
+    @classmethod
+    def invoke_urls(cls, urls):
+        """ Invokes many API urls at once over the asyncio client, returning their results in order """
+        if len(urls) <= 1:
+            return [cls.invoke_url(url) for url in urls]
+        from zotify.asyncapi import invoke_urls
+        return invoke_urls(urls)
 
     @classmethod
     def invoke_url(cls, url, tryCount=0):
         # we need to import that here, otherwise we will get circular imports!
         from zotify.termoutput import Printer, PrintChannel
-        headers = cls.get_auth_header()
-        response = requests.get(url, headers=headers)
-        responsetext = response.text
+        status, responsetext = cls.fetch_with_status(url)
         try:
-            responsejson = response.json()
+            responsejson = json.loads(responsetext)
         except json.decoder.JSONDecodeError:
             responsejson = {"error": {"status": "unknown", "message": "received an empty response"}}
 
         if not responsejson or 'error' in responsejson:
-            if tryCount < (cls.CONFIG.get_retry_attempts() - 1):
+            # api_get already retried server errors
+            if status < 500 and tryCount < (cls.CONFIG.get_retry_attempts() - 1):
                 Printer.print(PrintChannel.WARNINGS, f"Spotify API Error (try {tryCount + 1}) ({responsejson['error']['status']}): {responsejson['error']['message']}")
-                time.sleep(5)
+                cls.rate_limiter().backoff(tryCount)
                 return cls.invoke_url(url, tryCount + 1)
 
             Printer.print(PrintChannel.API_ERRORS, f"Spotify API Error ({responsejson['error']['status']}): {responsejson['error']['message']}")
@@ -107,4 +238,85 @@ class Zotify:
     @classmethod
     def check_premium(cls) -> bool:
         """ If user has spotify premium return true """
-        return (cls.SESSION.get_user_attribute(TYPE) == PREMIUM)
+        return (cls.SESSIONS.session.get_user_attribute(TYPE) == PREMIUM)
+
+    @classmethod
+    def get_download_quality(cls):
+        """ Returns the audio quality to stream, only asking the account when DOWNLOAD_QUALITY is auto """
+        if cls.DOWNLOAD_QUALITY is None:
+            from librespot.audio.decoders import AudioQuality
+            quality_options = {
+                'normal': AudioQuality.NORMAL,
+                'high': AudioQuality.HIGH,
+                'very_high': AudioQuality.VERY_HIGH
+            }
+            quality = cls.CONFIG.get_download_quality()
+            if quality == 'auto':
+                cls.DOWNLOAD_QUALITY = AudioQuality.VERY_HIGH if cls.check_premium() else AudioQuality.HIGH
+            else:
+                cls.DOWNLOAD_QUALITY = quality_options[quality]
+        return cls.DOWNLOAD_QUALITY
+
+
+class Paginator:
+    """Lazy iterator over the items of a paginated Web API collection.
+
+    The first page is fetched up front so len() is known for progress bars
+    before anything is downloaded. The remaining pages are fetched while
+    iterating, up to PAGE_FETCH_WORKERS of them ahead of the consumer, and
+    yielded in order. on_page is called with the raw items of each page as it
+    arrives (on the fetching thread), transform is applied to every item.
+    A Paginator can only be iterated once.
+    """
+    def __init__(self, url, limit, on_page, transform, params):
+        self.url = url
+        self.limit = limit
+        self.on_page = on_page
+        self.transform = transform
+        self.params = params
+
+        first = self._fetch(0)
+        self.total = first.get(TOTAL)
+        self._first = first
+
+    def __len__(self) -> int:
+        return self.total if self.total is not None else len(self._first[ITEMS])
+
+    def _fetch(self, offset) -> dict:
+        resp = Zotify.invoke_url_with_params(self.url, limit=self.limit, offset=offset, **self.params)
+        if self.on_page is not None:
+            self.on_page(resp[ITEMS])
+        return resp
+
+    def pages(self):
+        first, self._first = self._first, None
+        if first is None:
+            raise RuntimeError('Paginator can only be iterated once')
+        yield first[ITEMS]
+
+        if self.total is None:
+            # no total to plan with, walk the pages until a short one comes back
+            resp, offset = first, self.limit
+            while len(resp[ITEMS]) == self.limit:
+                resp = self._fetch(offset)
+                offset += self.limit
+                yield resp[ITEMS]
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+        offsets = iter(range(self.limit, self.total, self.limit))
+        executor = ThreadPoolExecutor(max_workers=Zotify.PAGE_FETCH_WORKERS)
+        try:
+            window = deque(executor.submit(self._fetch, offset) for offset in islice(offsets, Zotify.PAGE_FETCH_WORKERS))
+            while window:
+                resp = window.popleft().result()
+                for offset in islice(offsets, 1):
+                    window.append(executor.submit(self._fetch, offset))
+                yield resp[ITEMS]
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __iter__(self):
+        for page in self.pages():
+            for item in page:
+                yield self.transform(item) if self.transform is not None else item